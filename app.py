@@ -1,21 +1,47 @@
-from flask import Flask, request, abort
+from flask import Flask, Response, request, abort, jsonify, send_file
 from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
+from linebot.exceptions import InvalidSignatureError, LineBotApiError
 from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage,
     PostbackEvent, FlexSendMessage, FollowEvent
 )
 import os
-import smtplib
-from email.message import EmailMessage
+import json
 from dotenv import load_dotenv
 from datetime import date, datetime, timedelta, time
-from apscheduler.schedulers.background import BackgroundScheduler
+import threading
+import atexit
+import sys
+from journal import StateJournal, JournalLocked
+from sessions import SessionStore
+from fast_router import FastWebhookHandler
+from postback_token import PostbackTokens, InvalidPostbackToken, is_postback_token
+from metrics import registry
+from line_client import InstrumentedHttpClient, PrebuiltMessage
+from smtp_pool import SmtpPool
+from eventlog import EventLog, new_correlation_id, parse_sample_rates
+from funnel import Funnel
+from recorder import TrafficRecorder
+from spool import Spool
+from health import HealthProber
+from indexes import GroupIndex, IndexedDict, InvalidCursor
+from search import IntakeSearch
+from export import parse_summary, iter_csv, write_xlsx
+from intakes import IntakeStore
+from catalog import TemplateCatalog
+from questionnaire import QuestionnaireRegistry
+import hashlib
+import hmac
+from functools import wraps, partial
+from time import monotonic, sleep
 
 load_dotenv()
 
 app = Flask(__name__)
 
+MAX_WEBHOOK_BODY = int(os.getenv("MAX_WEBHOOK_BODY", str(1024 * 1024)))
+app.config["MAX_CONTENT_LENGTH"] = MAX_WEBHOOK_BODY
+
 # ====== 環境変数 ======
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
 LINE_CHANNEL_SECRET       = os.getenv("LINE_CHANNEL_SECRET")
@@ -28,94 +54,286 @@ SMTP_PASS = os.getenv("SMTP_PASS", "")
 SMTP_FROM = os.getenv("SMTP_FROM", "website@eel.style")
 OFFICE_TO = os.getenv("OFFICE_TO", "website@eel.style")  # 事務局宛
 
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-handler      = WebhookHandler(LINE_CHANNEL_SECRET)
+# 管理・診断用エンドポイントのトークン（未設定なら無効）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# ローカル検証時は mock_line_api.py の URL を指定する
+LINE_API_ENDPOINT = os.getenv("LINE_API_ENDPOINT", "https://api.line.me")
+
+# ====== ログ（JSON Lines、書き込みは別スレッド） ======
+# LOG_SAMPLE="msg=0.1,postback=0.1" のようにイベント名ごとの記録率を指定できる
+log = EventLog(sample=parse_sample_rates(os.getenv("LOG_SAMPLE", "")))
+
+LINE_POOL_SIZE = int(os.getenv("LINE_POOL_SIZE", "10"))
+
+line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN, endpoint=LINE_API_ENDPOINT,
+                          http_client=partial(InstrumentedHttpClient, pool_maxsize=LINE_POOL_SIZE))
+
+# 事務局メールの SMTP 接続（ログイン済みの接続を使い回す）
+smtp_pool = SmtpPool(SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, timeout=20,
+                     size=int(os.getenv("SMTP_POOL_SIZE", "2")))
+
+# ====== 表示名キャッシュ ======
+PROFILE_TTL    = int(os.getenv("PROFILE_TTL", "3600"))
+PROFILE_MAX    = 10000
+_profile_names = {}  # user_id -> (表示名, 期限)
+
+def display_name(user_id):
+    hit = _profile_names.get(user_id)
+    if hit is not None and hit[1] > monotonic():
+        return hit[0]
+    try:
+        name = line_bot_api.get_profile(user_id).display_name
+    except Exception:
+        return "ご利用者様"
+    if len(_profile_names) >= PROFILE_MAX:
+        try:
+            del _profile_names[next(iter(_profile_names))]
+        except (StopIteration, KeyError, RuntimeError):
+            pass
+    _profile_names[user_id] = (name, monotonic() + PROFILE_TTL)
+    return name
+
+# 既定は軽量ルーター（SDK モデルを組み立てない）。WEBHOOK_ROUTER=sdk で従来の WebhookHandler
+if os.getenv("WEBHOOK_ROUTER", "fast") == "sdk":
+    handler = WebhookHandler(LINE_CHANNEL_SECRET)
+else:
+    handler = FastWebhookHandler(LINE_CHANNEL_SECRET)
+
+# ====== 署名付きポストバック ======
+# POSTBACK_TOKENS=1 でボタン回答をポストバック data 側に持たせる
+postback_tokens = None
+if os.getenv("POSTBACK_TOKENS", "0") == "1":
+    _token_secret = os.getenv("POSTBACK_TOKEN_SECRET") or hmac.new(
+        (LINE_CHANNEL_SECRET or "").encode("utf-8"), b"postback-token", hashlib.sha256
+    ).hexdigest()
+    postback_tokens = PostbackTokens(_token_secret, max_age=int(os.getenv("POSTBACK_TOKEN_MAX_AGE", str(7 * 24 * 3600))))
+
+# ====== Webhook の記録（replay.py 用） ======
+# RECORD_WEBHOOKS=件数 で直近の受信内容を伏せ字にしてメモリに残す
+RECORD_WEBHOOKS = int(os.getenv("RECORD_WEBHOOKS", "0"))
+recorder = None
+if RECORD_WEBHOOKS > 0:
+    _record_salt = os.getenv("RECORD_SALT") or hmac.new(
+        (LINE_CHANNEL_SECRET or "").encode("utf-8"), b"recorder", hashlib.sha256
+    ).hexdigest()
+    recorder = TrafficRecorder(RECORD_WEBHOOKS, _record_salt.encode("utf-8"))
 
 # ====== 状態管理 ======
-user_states     = {}  # user_id -> dict(回答ステート)
-completed_users = {}  # user_id -> (完了日時, サマリー文字列)
+user_states     = SessionStore()  # user_id -> dict(回答ステート)、バージョン付き
+completed_users = IndexedDict(key=lambda v: v[0].timestamp())  # user_id -> (完了日時, サマリー文字列)、完了日時順の索引付き
 greeted_users   = set()
 released_users  = set()
 
+# ====== 永続化（状態ジャーナル） ======
+# STATE_DIR を指定すると状態遷移をジャーナルへ追記し、再起動時に復元する
+STATE_DIR     = os.getenv("STATE_DIR", "")
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "1") == "1"
+
+journal = None
+if STATE_DIR:
+    journal = StateJournal(
+        STATE_DIR,
+        {
+            "user_states":     user_states,
+            "completed_users": completed_users,
+            "greeted_users":   greeted_users,
+            "released_users":  released_users,
+        },
+        fsync=JOURNAL_FSYNC,
+    )
+
+def record(*op):
+    if journal is not None:
+        journal.append(*op)
+
+def journal_commit(user_id, old, new):
+    """回答ステートのコミットを差分でジャーナルへ記録する"""
+    if new is None:
+        record("drop", user_id)
+        return
+    if not new or (old and any(k not in new for k in old)):
+        record("new", user_id)
+        old = None
+    changed = {k: v for k, v in new.items() if not old or k not in old or old[k] != v}
+    if changed:
+        record("set", user_id, changed)
+
+# ====== 完了した問診の保存 ======
+# INTAKE_DB（未指定なら STATE_DIR/intakes.sqlite3、どちらもなければメモリ上）に回答そのものを残す
+INTAKE_DB             = os.getenv("INTAKE_DB") or (os.path.join(STATE_DIR, "intakes.sqlite3") if STATE_DIR else "")
+INTAKE_RETENTION_DAYS = int(os.getenv("INTAKE_RETENTION_DAYS", "0"))  # 0 なら消さない
+
+intake_store = IntakeStore(INTAKE_DB or None)
+if not intake_store.persistent:
+    log.warning("intake_db_in_memory", detail="INTAKE_DB / STATE_DIR が未設定のため、問診の保存・保存期間の削除は再起動で消えます")
+
+# ====== 送信待ちの永続キュー（事務局メール・フォローアップ） ======
+# SPOOL_DIR（未指定なら STATE_DIR/spool）があれば、送る前にディスクへ書いてから別スレッドで送る
+SPOOL_DIR = os.getenv("SPOOL_DIR") or (os.path.join(STATE_DIR, "spool") if STATE_DIR else "")
+
+spool = None
+if SPOOL_DIR:
+    spool = Spool(
+        SPOOL_DIR, fsync=JOURNAL_FSYNC,
+        on_error=lambda kind, item_id, attempts, e: log.warning(
+            "spool_retry", kind=kind, item=item_id, attempts=attempts, error=repr(e)),
+    )
+
+# ====== メトリクス（/metrics） ======
+WEBHOOK_SECONDS   = registry.histogram("webhook_stage_seconds", "callback の段階別所要時間", ["stage"])
+WEBHOOK_REQUESTS  = registry.counter("webhook_requests_total", "callback の応答数", ["status"])
+HANDLER_SECONDS   = registry.histogram("handler_seconds", "イベントハンドラの所要時間", ["handler"])
+SMTP_SECONDS      = registry.histogram("smtp_session_seconds", "事務局メールの SMTP セッション所要時間")
+SMTP_ERRORS       = registry.counter("smtp_errors_total", "事務局メールの送信失敗数")
+SCHEDULER_SECONDS = registry.histogram("scheduler_job_seconds", "定期ジョブの所要時間", ["job"])
+FOLLOWUPS_SENT    = registry.counter("followups_sent_total", "フォローアップの送信数")
+registry.gauge("user_states", "回答中のユーザー数", func=lambda: len(user_states))
+registry.gauge("completed_users", "フォローアップ待ちのユーザー数", func=lambda: len(completed_users))
+registry.gauge("greeted_users", "案内済みのユーザー数", func=lambda: len(greeted_users))
+registry.gauge("released_users", "通常チャットへ移行したユーザー数", func=lambda: len(released_users))
+registry.counter("session_conflicts_total", "回答ステート更新の競合回数", func=lambda: user_states.conflicts)
+registry.gauge("journal_queue_depth", "ジャーナル書き込み待ちの件数", func=lambda: journal.pending() if journal else 0)
+registry.gauge("log_queue_depth", "ログ書き込み待ちの件数", func=log.pending)
+registry.gauge("warmed_up", "起動時のウォームアップが済んでいれば 1", func=lambda: int(warmed_up.is_set()))
+registry.counter("log_dropped_total", "キューあふれで捨てたログの件数", func=lambda: log.dropped)
+registry.gauge("spool_backlog", "送信待ちのメール・push の件数", func=lambda: spool.backlog() if spool else 0)
+
+def correlated(func):
+    """イベントごとに相関ID（webhookEventId、無ければ採番）を付ける
+
+    handler.add の直下に置く。SDK の WebhookHandler は引数の数を見て
+    (event, destination) で呼ぶかを決めるので、*args の wrapper を直接登録しない。
+    """
+    @wraps(func)
+    def wrapper(event):
+        new_correlation_id(getattr(event, "webhook_event_id", None))
+        return func(event)
+    return wrapper
+
 # ====== 質問フロー ======
-QUESTION_STEPS = [
-    "都道府県", "お名前", "フリガナ", "電話番号",
-    "生年月日_年", "生年月日_月", "生年月日_日",
-    "性別", "身長", "体重",
-    "アルコール", "副腎皮質ホルモン剤", "がん", "糖尿病", "その他病気",
-    "病名",       # 「その他病気=はい」のときのみ
-    "お薬服用", "服用薬",  # 「お薬服用=はい」のときのみ
-    "アレルギー", "アレルギー名"  # 「アレルギー=はい」のときのみ
-]
+# 質問の並び・文面・入力チェックは QUESTIONNAIRE_PATH の JSON（questionnaire.py）。
+# 書き換えると QUESTIONNAIRE_CHECK_INTERVAL 秒以内に新しい版へ差し替わる（0 なら起動時のまま）。
+# 回答中のユーザーは開始時の版（ステートの "_qv"）のまま最後まで進む
+QUESTIONNAIRE_PATH = os.getenv("QUESTIONNAIRE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "questionnaires", "default.json")
+questionnaires     = QuestionnaireRegistry(
+    QUESTIONNAIRE_PATH,
+    archive_dir=os.path.join(STATE_DIR, "questionnaires") if STATE_DIR else "",
+    check_interval=float(os.getenv("QUESTIONNAIRE_CHECK_INTERVAL", "2")),
+)
+
+def flow_for(state):
+    return questionnaires.get(state.get("_qv"))
 
 def get_next_question(state):
-    for step in QUESTION_STEPS:
-        if step == "病名" and state.get("その他病気") != "はい":
-            continue
-        if step == "服用薬" and state.get("お薬服用") != "はい":
-            continue
-        if step == "アレルギー名" and state.get("アレルギー") != "はい":
-            continue
-        if step not in state:
-            return step
-    return None
+    return flow_for(state).next_question(state)
+
+# ステップごとの到達・回答・入力エラー・所要時間（/admin/funnel）。起動時の版のステップで集計する
+funnel = Funnel(questionnaires.current.steps)
+
+# ====== 管理画面用の索引 ======
+# 回答中のユーザーを「いま答えているステップ」ごとに、そのステップに来た順で並べる（/admin/sessions）
+# 完了済みは completed_users 自体が完了日時順の索引を持つ（/admin/completed）
+session_steps = GroupIndex()
+
+def index_session(user_id, state):
+    if state is None:
+        session_steps.discard(user_id)
+    else:
+        session_steps.set(user_id, get_next_question(state) or "回答済み", datetime.now().timestamp())
+
+def on_session_commit(user_id, old, new):
+    index_session(user_id, new)
+    if journal is not None:
+        journal_commit(user_id, old, new)
+
+# 完了した問診の検索（/admin/search）。お名前・フリガナ・電話番号の末尾・完了日で引く
+# 問診 DB の保存期間（INTAKE_RETENTION_DAYS）より長くは残さない
+SEARCH_KEEP_DAYS = int(os.getenv("SEARCH_KEEP_DAYS", "90"))
+if INTAKE_RETENTION_DAYS:
+    SEARCH_KEEP_DAYS = min(SEARCH_KEEP_DAYS or INTAKE_RETENTION_DAYS, INTAKE_RETENTION_DAYS)
+intake_search = IntakeSearch(keep_days=SEARCH_KEEP_DAYS)
+
+# ====== 文面テンプレート ======
+# サマリー・完了メッセージ・事務局メール・フォローアップの文面は TEMPLATE_DIR のファイル。
+# 書き換えると TEMPLATE_CHECK_INTERVAL 秒以内に反映される（0 なら起動時のまま）
+TEMPLATE_DIR = os.getenv("TEMPLATE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+catalog      = TemplateCatalog(TEMPLATE_DIR, check_interval=float(os.getenv("TEMPLATE_CHECK_INTERVAL", "2")))
 
 # ====== メール送信（事務局通知） ======
 def send_summary_email_to_office(summary, user_id):
-    subject = "東京MITクリニック 妊活オンライン診療：問診を受け付けました（事務局通知）"
+    nickname = display_name(user_id)
+    mail = {
+        "user_id": user_id,
+        "subject": catalog.render("office_mail_subject.txt"),
+        "body":    catalog.render("office_mail.txt", user_id=user_id, nickname=nickname, summary=summary),
+    }
+    if spool is not None:
+        spool.put("mail", mail)
+        return
+    try:
+        deliver_office_mail(None, mail)
+    except Exception as e:
+        log.error("office_mail_error", user=user_id, error=repr(e))
+
+def deliver_office_mail(item_id, mail):
+    # 問診完了時しか使わないので起動時には読み込まない
+    from email.message import EmailMessage
+
     msg = EmailMessage()
-    msg["Subject"] = subject
+    msg["Subject"] = mail["subject"]
     msg["From"]    = SMTP_FROM
     msg["To"]      = OFFICE_TO
+    if item_id:
+        msg["Message-ID"] = f"<{item_id}@my-line-bot>"  # 再送しても同じ ID
+    msg.set_content(mail["body"])
 
     try:
-        nickname = line_bot_api.get_profile(user_id).display_name
-    except:
-        nickname = "ご利用者様"
-
-    msg.set_content(
-        "以下の内容で問診の受け付けが完了しました。\n\n"
-        f"ユーザーID: {user_id}\n"
-        f"表示名: {nickname}\n\n"
-        f"{summary}"
-    )
-
-    try:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=20) as smtp:
-            smtp.ehlo()
-            try:
-                smtp.starttls()
-                smtp.ehlo()
-            except:
-                pass
-            if SMTP_USER and SMTP_PASS:
-                smtp.login(SMTP_USER, SMTP_PASS)
+        with SMTP_SECONDS.time(), smtp_pool.connection() as smtp:
             smtp.send_message(msg)
-    except Exception as e:
-        print("【問診結果メール送信エラー（事務局）】", repr(e))
+    except Exception:
+        SMTP_ERRORS.inc()
+        raise
 
 # ====== 初期化（開始メッセージ） ======
 def start_registration(user_id, reply_token):
-    user_states[user_id] = {}
+    flow = questionnaires.get()
+    user_states[user_id] = {"_qv": flow.version}
     completed_users.pop(user_id, None)
-    try:
-        _ = line_bot_api.get_profile(user_id).display_name
-    except:
-        pass
-    line_bot_api.reply_message(
-        reply_token,
-        TextSendMessage(text="お住まいの都道府県名を入力してください。")
-    )
+    record("undone", user_id)
+    intake_store.supersede(user_id)  # 回答し直している人には前回分のフォローアップを送らない
+    funnel.enter(user_id, flow.steps[0])
+    display_name(user_id)  # 完了時のために表示名を取っておく
+    reply = flow.first_reply()
+    if reply[0] == "buttons":
+        send_buttons(reply_token, reply[1], reply[2], user_id, user_states[user_id])
+    else:
+        line_bot_api.reply_message(reply_token, prebuilt_text(reply[1]))
 
 # ====== 友だち追加で即開始 ======
 @handler.add(FollowEvent)
+@correlated
+@HANDLER_SECONDS.timed(handler="follow")
 def handle_follow(event):
     uid = event.source.user_id
+    log.info("follow", user=uid)
     greeted_users.add(uid)
+    record("greet", uid)
     start_registration(uid, event.reply_token)
 
 # ====== Flexボタン送信 ======
-def send_buttons(reply_token, text, buttons):
+def send_buttons(reply_token, text, buttons, user_id=None, state=None):
+    if postback_tokens is not None and user_id is not None:
+        buttons = [
+            {"label": b["label"], "data": postback_tokens.pack(user_id, b["data"], state or {})}
+            for b in buttons
+        ]
+        message = build_buttons(text, buttons)
+    else:
+        message = prebuilt_buttons(text, buttons)
+    line_bot_api.reply_message(reply_token, message)
+
+def build_buttons(text, buttons):
     contents = {
         "type": "bubble",
         "body": {
@@ -139,30 +357,165 @@ def send_buttons(reply_token, text, buttons):
             ]
         }
     }
-    line_bot_api.reply_message(reply_token, FlexSendMessage(alt_text=text, contents=contents))
-
-
-
+    return FlexSendMessage(alt_text=text, contents=contents)
+
+# ====== 定型メッセージ（組み立て済みを使い回す） ======
+_prebuilt = {}
+
+def prebuilt_text(text):
+    msg = _prebuilt.get(text)
+    if msg is None:
+        msg = _prebuilt[text] = PrebuiltMessage(TextSendMessage(text=text))
+    return msg
+
+def prebuilt_buttons(text, buttons):
+    key = (text, tuple(b["data"] for b in buttons))
+    msg = _prebuilt.get(key)
+    if msg is None:
+        msg = _prebuilt[key] = PrebuiltMessage(build_buttons(text, buttons))
+    return msg
+
+
+
+
+# ====== 管理者認証 ======
+def require_admin(func):
+    """Authorization: Bearer <ADMIN_TOKEN> が必要。ADMIN_TOKEN 未設定なら 404"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            abort(404)
+        auth  = request.headers.get("Authorization", "")
+        token = auth[7:] if auth.startswith("Bearer ") else request.headers.get("X-Admin-Token", "")
+        if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+            abort(401)
+        return func(*args, **kwargs)
+    return wrapper
+
+@app.route("/debug/profile", methods=["GET"])
+@require_admin
+def debug_profile():
+    import sampling_profiler
+    try:
+        seconds  = float(request.args.get("seconds", "10"))
+        interval = float(request.args.get("interval_ms", "5"))
+    except ValueError:
+        return "seconds / interval_ms は数値で指定してください", 400
+    if not (0 < seconds < float("inf")) or not (0 < interval < float("inf")):
+        return "seconds / interval_ms は正の数で指定してください", 400
+    seconds  = min(seconds, float(os.getenv("PROFILE_MAX_SECONDS", "25")))
+    interval = max(interval, 1.0) / 1000.0
+    try:
+        counts = sampling_profiler.sample(seconds, interval, include_idle=request.args.get("idle") == "1")
+    except sampling_profiler.ProfilerBusy:
+        return "profiling already in progress", 409
+    if request.args.get("format") == "top":
+        return Response(sampling_profiler.top(counts), mimetype="text/plain; charset=utf-8")
+    return Response(sampling_profiler.collapsed(counts), mimetype="text/plain; charset=utf-8")
+
+# ====== メモリ診断 ======
+@app.route("/debug/memory", methods=["GET"])
+@require_admin
+def debug_memory():
+    import memdiag
+    info = memdiag.status()
+    info["structures"] = memdiag.structure_sizes({
+        "user_states":     user_states,
+        "completed_users": completed_users,
+        "greeted_users":   greeted_users,
+        "released_users":  released_users,
+    })
+    return jsonify(info)
+
+@app.route("/debug/memory/<action>", methods=["POST"])
+@require_admin
+def debug_memory_action(action):
+    import memdiag
+    if action == "start":
+        try:
+            frames = int(request.args.get("frames", "10"))
+        except ValueError:
+            return jsonify({"error": "frames は整数で指定してください"}), 400
+        if not 1 <= frames <= 65535:  # tracemalloc が受け付ける範囲
+            return jsonify({"error": "frames は 1〜65535 で指定してください"}), 400
+        return jsonify(memdiag.start(frames))
+    if action == "stop":
+        return jsonify(memdiag.stop())
+    if action == "snapshot":
+        try:
+            return jsonify({"id": memdiag.take_snapshot()})
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 409
+    abort(404)
+
+@app.route("/debug/memory/top", methods=["GET"])
+@require_admin
+def debug_memory_top():
+    import memdiag
+    try:
+        limit = int(request.args.get("limit", "20"))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return jsonify({"error": "limit は 1 以上の整数で指定してください"}), 400
+    group_by = request.args.get("group", "lineno")
+    try:
+        if "from" in request.args:
+            return jsonify(memdiag.diff(int(request.args["from"]), int(request.args["to"]), limit, group_by))
+        return jsonify(memdiag.top(int(request.args["snapshot"]), limit, group_by))
+    except (KeyError, ValueError):
+        return jsonify({"error": "snapshot / from & to を指定してください"}), 400
+    except memdiag.UnknownSnapshot as e:
+        return jsonify({"error": f"unknown snapshot {e}"}), 404
+
+@app.route("/debug/recording", methods=["GET", "DELETE"])
+@require_admin
+def debug_recording():
+    if recorder is None:
+        return jsonify({"error": "RECORD_WEBHOOKS が未設定です"}), 404
+    if request.method == "DELETE":
+        recorder.clear()
+        return "", 204
+    return Response(recorder.dump_jsonl(), mimetype="application/x-ndjson",
+                    headers={"Content-Disposition": "attachment; filename=recording.jsonl"})
 
 @app.route("/debug/smtp-test", methods=["GET"])
 def debug_smtp():
-    try:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=5) as smtp:
-            smtp.ehlo()
+    # 毎回つなぎに行かず、/ready と同じ定期チェックの結果を返す
+    ok, detail, _ = prober.result("smtp")
+    if ok:
         return "SMTP reachable", 200
-    except Exception as e:
-        return f"SMTP error: {e}", 500
+    return f"SMTP error: {detail['error']}", 500
 
 
 
 
 
 
+# ====== 返信 ======
+# 状態遷移は返信内容だけを返し、返信はコミット後にまとめて行う
+#   ("text", 本文) / ("buttons", 本文, ボタン) / ("finalize",)
+def send_reply(event, user_id, state, reply):
+    if reply is None:
+        return
+    kind = reply[0]
+    if kind == "text":
+        line_bot_api.reply_message(event.reply_token, prebuilt_text(reply[1]))
+    elif kind == "buttons":
+        send_buttons(event.reply_token, reply[1], reply[2], user_id, state)
+    elif kind == "finalize":
+        finalize_response(event, user_id, state)
+
+WAIT_REPLY = ("text", "問診を受け付けました。回答まで今しばらくお待ち下さい。")
+
 # ====== テキスト受信 ======
 @handler.add(MessageEvent, message=TextMessage)
+@correlated
+@HANDLER_SECONDS.timed(handler="text")
 def handle_text(event):
     user_id = event.source.user_id
     text    = event.message.text.strip()
+    log.info("msg", user=user_id, length=len(text))  # 本文は個人情報なので残さない
 
     # フォローアップ後は通常チャットへ
     if user_id in released_users:
@@ -170,381 +523,111 @@ def handle_text(event):
 
     # 完了後〜翌朝9時までは固定メッセージ
     if user_id in completed_users:
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="問診を受け付けました。回答まで今しばらくお待ち下さい。")
-        )
+        send_reply(event, user_id, None, WAIT_REPLY)
         return
 
-    state = user_states.setdefault(user_id, {})
-
     # フォールバック：FollowEvent取りこぼし時
-    if (user_id not in greeted_users) and not state:
+    if (user_id not in greeted_users) and not user_states.get(user_id):
         greeted_users.add(user_id)
+        record("greet", user_id)
         start_registration(user_id, event.reply_token)
         return
 
-    # フロー進行
-    step = get_next_question(state)
-
-    if step == "都道府県":
-        state["都道府県"] = text
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="ご氏名（保険証と同じお名前を漢字フルネーム）を入力してください。")
-        )
-        return
-
-    if step == "お名前":
-        state["お名前"] = text
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="フリガナ（カタカナ）を入力してください。")
-        )
-        return
-
-    if step == "フリガナ":
-        state["フリガナ"] = text
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="お電話番号（ハイフンなし）を入力してください。")
-        )
-        return
-
-    if step == "電話番号":
-        if text.isdigit() and len(text) in (10,11):
-            state["電話番号"] = text
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="生まれた西暦（4桁）を入力してください。")
-            )
-        else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="電話番号は10桁または11桁の数字で入力してください。")
-            )
-        return
-
-    if step == "生年月日_年":
-        if text.isdigit() and len(text)==4 and 1900<=int(text)<=2100:
-            state["生年月日_年"] = int(text)
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="生まれた月（1〜12）を入力してください。")
-            )
-            return
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="西暦4桁で入力してください（例：1988）")
-        )
-        return
-
-    if step == "生年月日_月":
-        if text.isdigit() and 1<=int(text)<=12:
-            state["生年月日_月"] = int(text)
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="生まれた日（1〜31）を入力してください。")
-            )
-        else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="月は1〜12の数字で入力してください。")
-            )
-        return
-
-    if step == "生年月日_日":
-        if text.isdigit():
-            d = int(text)
-            y = state.get("生年月日_年")
-            m = state.get("生年月日_月")
-            try:
-                birth = date(y,m,d)
-                state["生年月日_日"] = d
-                state["生年月日"]  = birth.strftime("%Y-%m-%d")
-                today = date.today()
-                age   = today.year - birth.year - ((today.month,today.day) < (birth.month,birth.day))
-                state["満年齢"] = age
-                send_buttons(
-                    event.reply_token,
-                    "性別を選択してください。",
-                    [{"label":"女","data":"gender_female"},{"label":"男","data":"gender_male"}]
-                )
-                return
-            except:
-                pass
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="正しい日付を入力してください。")
-        )
-        return
-
-    if step == "性別":
-        send_buttons(
-            event.reply_token,
-            "性別を選択してください。",
-            [{"label":"女","data":"gender_female"},{"label":"男","data":"gender_male"}]
-        )
-        return
-
-    if step == "身長":
-        if text.isdigit() and 100<=int(text)<=250:
-            state["身長"] = f"{int(text)}"
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="体重（kg）を入力してください。")
-            )
-        else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="身長は100〜250の数字で入力してください。")
-            )
-        return
-
-    if step == "体重":
-        if text.isdigit() and 20<=int(text)<=200:
-            state["体重"] = f"{int(text)}"
-            send_buttons(
-                event.reply_token,
-                "アルコールを常習的に摂取していますか？",
-                [{"label":"はい","data":"alcohol_yes"},{"label":"いいえ","data":"alcohol_no"}]
-            )
-        else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="体重は20〜200の数字で入力してください。")
-            )
-        return
-
-    if step in ("アルコール","副腎皮質ホルモン剤","がん","糖尿病","その他病気","お薬服用","アレルギー"):
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="画面のボタンからお答えください。")
-        )
-        return
-
-    if step == "病名":
-        if text:
-            state["病名"] = text
-            send_buttons(
-                event.reply_token,
-                "現在、お薬を服用していますか？",
-                [{"label":"はい","data":"med_yes"},{"label":"いいえ","data":"med_no"}]
-            )
-        else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="病名（不明なら治療内容）を入力してください。")
-            )
-        return
-
-    if step == "服用薬":
-        if text:
-            state["服用薬"] = text
-            send_buttons(
-                event.reply_token,
-                "アレルギーはありますか？",
-                [{"label":"はい","data":"allergy_yes"},{"label":"いいえ","data":"allergy_no"}]
-            )
-        else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="服用薬の名称を入力してください。")
-            )
-        return
-
-    if step == "アレルギー名":
-        if text:
-            state["アレルギー名"] = text
-            finalize_response(event, user_id, state)
-        else:
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="アレルギー名を入力してください。")
-            )
-        return
-
-    # デフォルト
-    line_bot_api.reply_message(
-        event.reply_token,
-        TextSendMessage(text="次の入力をお願いします。")
-    )
+    # フロー進行（競合したら最新のステートでやり直す）
+    seen = {}
+    def step(state):
+        seen["before"] = None if state.get("_finalized") else get_next_question(state)
+        return advance_text(user_id, state, text)
+    reply, state = user_states.transact(user_id, step)
+    funnel.transition(user_id, seen["before"], get_next_question(state))
+    send_reply(event, user_id, state, reply)
+
+def advance_text(user_id, state, text):
+    if state.get("_finalized"):
+        return WAIT_REPLY
+    flow = flow_for(state)
+    state.setdefault("_qv", flow.version)  # 版を持たない（以前からの）回答中ユーザーはここで固定する
+    return flow.advance_text(state, text)
 
 # ====== ポストバック処理 ======
 @handler.add(PostbackEvent)
+@correlated
+@HANDLER_SECONDS.timed(handler="postback")
 def handle_postback(event):
     user_id = event.source.user_id
+    log.info("postback", user=user_id)
 
     # 完了後〜翌朝9時までは固定メッセージ
     if user_id in completed_users:
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="問診を受け付けました。回答まで今しばらくお待ち下さい。")
-        )
+        send_reply(event, user_id, None, WAIT_REPLY)
         return
     # フォローアップ後は通常チャットへ移行
     if user_id in released_users:
         return
 
-    state = user_states.setdefault(user_id, {})
-    data  = event.postback.data
-
-    mapping = {
-        "gender_female": ("性別", "女"),
-        "gender_male":   ("性別", "男"),
-        "alcohol_yes":   ("アルコール", "はい"),
-        "alcohol_no":    ("アルコール", "いいえ"),
-        "steroid_yes":   ("副腎皮質ホルモン剤", "はい"),
-        "steroid_no":    ("副腎皮質ホルモン剤", "いいえ"),
-        "cancer_yes":    ("がん", "はい"),
-        "cancer_no":     ("がん", "いいえ"),
-        "diabetes_yes":  ("糖尿病", "はい"),
-        "diabetes_no":   ("糖尿病", "いいえ"),
-        "other_yes":     ("その他病気", "はい"),
-        "other_no":      ("その他病気", "いいえ"),
-        "med_yes":       ("お薬服用", "はい"),
-        "med_no":        ("お薬服用", "いいえ"),
-        "allergy_yes":   ("アレルギー", "はい"),
-        "allergy_no":    ("アレルギー", "いいえ"),
-    }
-
-    if data in mapping:
-        key,val = mapping[data]
-        state[key] = val
-
-    if data in ("gender_female","gender_male"):
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="身長（cm）を入力してください。")
-        )
-        return
-
-    if data in ("alcohol_yes","alcohol_no"):
-        send_buttons(
-            event.reply_token,
-            "副腎皮質ホルモン剤を投与中ですか？",
-            [{"label":"はい","data":"steroid_yes"},{"label":"いいえ","data":"steroid_no"}]
-        )
-        return
-
-    if data in ("steroid_yes","steroid_no"):
-        send_buttons(
-            event.reply_token,
-            "がんにかかっていて治療中ですか？",
-            [{"label":"はい","data":"cancer_yes"},{"label":"いいえ","data":"cancer_no"}]
-        )
-        return
-
-    if data in ("cancer_yes","cancer_no"):
-        send_buttons(
-            event.reply_token,
-            "糖尿病で治療中ですか？",
-            [{"label":"はい","data":"diabetes_yes"},{"label":"いいえ","data":"diabetes_no"}]
-        )
-        return
-
-    if data in ("diabetes_yes","diabetes_no"):
-        send_buttons(
-            event.reply_token,
-            "そのほか現在、治療中、通院中の病気はありますか？",
-            [{"label":"はい","data":"other_yes"},{"label":"いいえ","data":"other_no"}]
-        )
-        return
-
-    if data == "other_yes":
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="病気の名称（わからなければ治療内容）を入力してください。")
-        )
-        return
-
-    if data == "other_no":
-        send_buttons(
-            event.reply_token,
-            "現在、お薬を服用していますか？",
-            [{"label":"はい","data":"med_yes"},{"label":"いいえ","data":"med_no"}]
-        )
-        return
-
-    if data == "med_yes":
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="お薬の名前をすべてお伝えください。")
-        )
-        return
+    data    = event.postback.data
+    carried = None
+    if postback_tokens is not None and is_postback_token(data):
+        try:
+            data, carried = postback_tokens.unpack(user_id, data)
+        except InvalidPostbackToken:
+            log.warning("invalid_postback_token", user=user_id)
+            send_reply(event, user_id, None, ("text", questionnaires.current.messages["use_buttons"]))
+            return
 
-    if data == "med_no":
-        send_buttons(
-            event.reply_token,
-            "アレルギーはありますか？",
-            [{"label":"はい","data":"allergy_yes"},{"label":"いいえ","data":"allergy_no"}]
-        )
-        return
+    stored = user_states.get(user_id, {})
+    if carried is not None and data not in flow_for(stored).commits:
+        # ボタンが続く間はサーバーへ書かず、回答はトークンで次のボタンへ引き継ぐ
+        # （次が自由入力・完了になるボタンは書く）
+        state  = {**stored, **carried}
+        before = None if state.get("_finalized") else get_next_question(state)
+        reply  = advance_postback(user_id, state, data)
+    else:
+        seen = {}
+        def step(state):
+            if carried:
+                state.update(carried)  # ボタン回答はトークン側を正とする
+            seen["before"] = None if state.get("_finalized") else get_next_question(state)
+            return advance_postback(user_id, state, data)
+        reply, state = user_states.transact(user_id, step)
+        before = seen["before"]
+    after = get_next_question(state)
+    if after != before:  # 古いボタンの押し直しは入力エラーに数えない
+        funnel.transition(user_id, before, after)
+    send_reply(event, user_id, state, reply)
+
+def advance_postback(user_id, state, data):
+    # 二度押しで完了処理が重ならないように
+    if state.get("_finalized"):
+        return WAIT_REPLY
+    flow = flow_for(state)
+    state.setdefault("_qv", flow.version)
+    return flow.advance_postback(state, data)
 
-    if data == "allergy_yes":
-        line_bot_api.reply_message(
-            event.reply_token,
-            TextSendMessage(text="アレルギー名をお伝えください。")
-        )
-        return
+# ====== まとめ & 送信 ======
+def birth_date(state):
+    try:
+        return date(state["生年月日_年"], state["生年月日_月"], state["生年月日_日"])
+    except (KeyError, TypeError, ValueError):
+        pass
+    try:
+        return date.fromisoformat(state.get("生年月日", ""))
+    except (TypeError, ValueError):
+        return None
 
-    if data == "allergy_no":
-        finalize_response(event, user_id, state)
-        return
+def build_summary(state):
+    birth = birth_date(state)
+    if birth is not None and "生年月日" not in state:
+        state["生年月日"] = birth.isoformat()
+    return catalog.render("summary.txt", a=state, birth=birth, age=state.get("満年齢"))
 
-# ====== まとめ & 送信 ======
 def finalize_response(event, user_id, state):
-    # 生年月日が分割で入っていれば整形
-    if "生年月日" not in state and all(k in state for k in ("生年月日_年","生年月日_月","生年月日_日")):
-        birth = date(state["生年月日_年"],state["生年月日_月"],state["生年月日_日"])
-        state["生年月日"] = birth.strftime("%Y-%m-%d")
-
-    # サマリー作成
-    ordered_keys = [
-        "都道府県","お名前","フリガナ","電話番号",
-        "生年月日","性別","身長","体重",
-        "アルコール","副腎皮質ホルモン剤","がん","糖尿病","その他病気",
-        "病名","お薬服用","服用薬","アレルギー","アレルギー名"
-    ]
-    lines=[]
-    if "お名前" in state:
-        if "フリガナ" in state:
-            lines.append(f"お名前: {state['お名前']}（{state['フリガナ']}）")
-        else:
-            lines.append(f"お名前: {state['お名前']}")
-    for k in ordered_keys:
-        if k in ("お名前","フリガナ") or k not in state:
-            continue
-        v=state[k]
-        if k=="生年月日":
-            try:
-                bd = datetime.strptime(v,"%Y-%m-%d").date()
-                age=state.get("満年齢")
-                lines.append(f"生年月日: {bd.year}年{bd.month}月{bd.day}日（満{age}歳）")
-            except:
-                lines.append(f"生年月日: {v}")
-        elif k=="身長":
-            lines.append(f"身長: {v} cm")
-        elif k=="体重":
-            lines.append(f"体重: {v} kg")
-        else:
-            lines.append(f"{k}: {v}")
-    summary_text="\n".join(lines)
+    summary_text = build_summary(state)
 
     # 元の問診完了メッセージを表示
-    try:
-        nickname = line_bot_api.get_profile(user_id).display_name
-    except:
-        nickname = "ご利用者様"
-
-    user_message = (
-        f"{nickname}様\n"
-        "ご回答、ありがとうございました。\n"
-        "以下がご入力いただいた内容になりますので、ご確認ください。\n\n"
-        f"{summary_text}\n\n"
-        "このあと、問診に対する記入内容を確認し、お薬を処方できるか否か、お返事いたします。\n"
-        "医師による回答までに最大24時間（翌日午前9時までに回答）をいただきますことを、ご了承ください。"
-    )
+    nickname = display_name(user_id)
+
+    user_message = catalog.render("completed.txt", nickname=nickname, summary=summary_text)
 
     # ① 詳細サマリー＋お礼
     # ② 固定待機メッセージ
@@ -552,7 +635,7 @@ def finalize_response(event, user_id, state):
         event.reply_token,
         [
             TextSendMessage(text=user_message),
-            TextSendMessage(text="問診を受け付けました。回答まで今しばらくお待ち下さい。")
+            prebuilt_text(WAIT_REPLY[1])
         ]
     )
 
@@ -560,80 +643,573 @@ def finalize_response(event, user_id, state):
     send_summary_email_to_office(summary_text, user_id)
 
     # 翌朝9時のフォローアップ用に保存
-    completed_users[user_id] = (datetime.now(), summary_text)
+    finished_at = datetime.now()
+    completed_users[user_id] = (finished_at, summary_text)
+    record("done", user_id, finished_at.timestamp(), summary_text)
+    intake_store.add(user_id, finished_at, nickname, {k: v for k, v in state.items() if not k.startswith("_")})
+    intake_search.add(user_id, finished_at.timestamp(),
+                      state.get("お名前", ""), state.get("フリガナ", ""), state.get("電話番号", ""))
+    log.info("completed", user=user_id)
 
     # ステート破棄
     user_states.pop(user_id, None)
 
+# ====== 起動時の復元 ======
+# ジャーナル → 回答中の索引 → 問診の保存・検索の順に作り直す。
+# preload では親で一度、ワーカーを fork するたびにもう一度呼ぶ（作り直されたワーカーが
+# 親の古い状態・古い世代のままジャーナルを書き始めないように）
+def restore_state():
+    user_states.on_commit = None  # 再生中の変更はジャーナルへ書き戻さない
+    if journal is not None:
+        journal.recover()
+    session_steps.clear()
+    for uid, state in user_states.items():
+        index_session(uid, state)
+    user_states.on_commit = on_session_commit
+
+    if not intake_store.count():
+        # 保存を始める前に完了していた分（ジャーナルのサマリー）を取り込む
+        for uid, (finished_at, summary) in sorted(completed_users.items(), key=lambda kv: kv[1][0]):
+            intake_store.add(uid, finished_at, "", parse_summary(summary))
+
+    intake_search.clear()
+    since = datetime.now() - timedelta(days=intake_search.keep_days) if intake_search.keep_days else None
+    for intake in intake_store.iter_range(since):
+        answers = intake["answers"]
+        intake_search.add(intake["user_id"], intake["finished_at"].timestamp(),
+                          answers.get("お名前", ""), answers.get("フリガナ", ""), answers.get("電話番号", ""))
+
+restore_state()
+
 # ====== フォローアップ送信（詳細） ======
 from linebot.models import TextSendMessage
 
-def send_followup(uid):
-    try:
-        nickname = line_bot_api.get_profile(uid).display_name
-    except:
-        nickname = "ご利用者様"
-
-    combined_text = (
-        f"{nickname}様の問診内容を確認しました。\n"
-        "GHRP-2を定期的に服用されることについて、問題はありません。\n"
-        "下記より処方のお手続きにお進みください。\n\n"
-        "なお、処方計画は次のとおりです。この計画にもとづき、"
-        "継続的に医療用医薬品をお届けします。\n\n"
-        "１クール　30日分\n"
-        "GHRP-2　60錠　一日２錠を眠前１時間以内を目安に服用\n\n"
-        "初回は１クール（30日分＝60錠）をお届けします。\n"
-        "以降、服用中止の申し出をいただくまでの間、30日ごとに１クールを継続的にお届けします。\n"
-        "※半年ごとに定期問診を行います（無料）。\n\n"
-        "ご購入はこちらから >>\n"
-        "https://mit-tokyo.clinic/anela_japan/ghrp-2_third/"
-    )
+def followup_text(nickname):
+    return catalog.render("followup.txt", nickname=nickname)
 
-    line_bot_api.push_message(
-        uid,
-        messages=[TextSendMessage(text=combined_text)]
-    )
+def send_followup(uid):
+    combined_text = followup_text(display_name(uid))
+
+    if spool is not None:
+        spool.put("push", {"user_id": uid, "text": combined_text})
+    else:
+        line_bot_api.push_message(
+            uid,
+            messages=[TextSendMessage(text=combined_text)]
+        )
 
     # 通常チャットへ移行
     released_users.add(uid)
+    record("release", uid)
+
+def push_once(to, messages, retry_key):
+    """X-Line-Retry-Key 付きの push（再送しても二重には届かない）"""
+    # SDK の retry_key 引数は LineBotApi.headers を書き換えたままにするので使わない
+    data = {"to": to, "messages": [m.as_json_dict() for m in messages]}
+    try:
+        line_bot_api._post("/v2/bot/message/push", data=json.dumps(data),
+                           headers={"Content-Type": "application/json", "X-Line-Retry-Key": retry_key})
+    except LineBotApiError as e:
+        if e.status_code != 409:  # 同じキーで受付済み
+            raise
+
+def deliver_followup(item_id, push):
+    push_once(push["user_id"], [TextSendMessage(text=push["text"])], item_id)
+
+if spool is not None:
+    spool.register("mail", deliver_office_mail)
+    spool.register("push", deliver_followup)
 
 # ====== 翌朝9時の自動送信 ======
-def schedule_daily_followup():
-    now       = datetime.now()
+def followup_targets(now):
+    # 前日までに完了してフォローアップ待ちのままの人が対象（問診 DB から引く。
+    # 回答し直し始めた人は start_registration で superseded になっているので入らない）
     yesterday = now.date() - timedelta(days=1)
     cutoff    = datetime.combine(yesterday, time(23,59,59))
+    return intake_store.pending_followups(cutoff)
 
-    targets = [uid for uid,(finished_at,_) in completed_users.items() if finished_at <= cutoff]
-    for uid in targets:
+@SCHEDULER_SECONDS.timed(job="daily_followup")
+def schedule_daily_followup():
+    new_correlation_id()
+    targets = followup_targets(datetime.now())
+    log.info("followup_run", targets=len(targets))
+    for i, uid in enumerate(targets):
+        if draining.is_set():
+            # 終了中は区切りで抜ける（残りは pending のまま次の回で送る）
+            log.info("followup_interrupted", remaining=len(targets) - i)
+            break
         send_followup(uid)
-        del completed_users[uid]
+        FOLLOWUPS_SENT.inc()
+        intake_store.mark_followed_up(uid, datetime.now())
+        completed_users.pop(uid, None)
+        record("undone", uid)
+
+# ====== 保存期間を過ぎた問診の削除 ======
+@SCHEDULER_SECONDS.timed(job="purge_intakes")
+def purge_intakes(batch=500, max_batches=20):
+    # 1回の DELETE は batch 件まで。問診完了の書き込みを長く待たせない
+    cutoff  = datetime.now() - timedelta(days=INTAKE_RETENTION_DAYS)
+    deleted = 0
+    for _ in range(max_batches):
+        n = intake_store.purge(cutoff, batch)
+        deleted += n
+        if n < batch:
+            break
+        sleep(0.05)
+    # 検索の索引からも同じ期間で消す（名前・電話番号が DB より長く引けないように）
+    intake_search.expire(cutoff.timestamp())
+    if deleted:
+        log.info("intakes_purged", rows=deleted)
+
+# ====== スナップショット圧縮 ======
+@SCHEDULER_SECONDS.timed(job="compact_journal")
+def compact_journal():
+    if journal is not None and journal.appended:
+        journal.compact()
+
+scheduler = None
+
+def start_scheduler():
+    global scheduler
+    from apscheduler.schedulers.background import BackgroundScheduler
+    sched = BackgroundScheduler(timezone="Asia/Tokyo")
+    sched.add_job(schedule_daily_followup, 'cron', hour=9, minute=0)
+    if journal is not None:
+        sched.add_job(compact_journal, 'interval', minutes=int(os.getenv("SNAPSHOT_INTERVAL_MIN", "10")))
+    if INTAKE_RETENTION_DAYS:
+        sched.add_job(purge_intakes, 'interval', minutes=10)
+    sched.start()
+    scheduler = sched
+
+def start_scheduler_when_leader(path):
+    """ロックを取れたプロセスだけがスケジューラを動かす（取れなければ1分ごとに再試行）"""
+    import fcntl
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except OSError:
+            sleep(60)
+    log.info("scheduler_leader", pid=os.getpid())
+    start_scheduler()
+
+# ====== ウォームアップ ======
+# 接続・定型メッセージ・表示名を用意してから /ping を 200 にする（WARMUP=0 で無効）
+WARMUP                = os.getenv("WARMUP", "1") == "1"
+LINE_WARM_CONNECTIONS = int(os.getenv("LINE_WARM_CONNECTIONS", "2"))
+WARM_PROFILES         = int(os.getenv("WARM_PROFILES", "0"))  # 復元したユーザーの表示名を先に取る件数
+warmed_up             = threading.Event()
+
+def warm_replies():
+    catalog.load_all()
+    prebuilt_text(WAIT_REPLY[1])
+    for reply in questionnaires.current.replies():
+        if reply[0] == "text":
+            prebuilt_text(reply[1])
+        elif reply[0] == "buttons":
+            prebuilt_buttons(reply[1], reply[2])
+
+def warm_line():
+    # 同時に投げてプールに複数本つないでおく
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=LINE_WARM_CONNECTIONS) as pool:
+        for f in [pool.submit(line_bot_api.get_bot_info) for _ in range(LINE_WARM_CONNECTIONS)]:
+            f.result()
+
+def warm_smtp():
+    smtp_pool.warm(1)
+
+def warm_profiles():
+    uids = list(completed_users) + [uid for uid, _ in user_states.items()]
+    for uid in uids[:WARM_PROFILES]:
+        display_name(uid)
+
+def warm_up():
+    for name, func in (("replies", warm_replies), ("line", warm_line), ("smtp", warm_smtp), ("profiles", warm_profiles)):
+        started = monotonic()
+        try:
+            func()
+            log.info("warmup", step=name, ms=round((monotonic() - started) * 1000, 1))
+        except Exception as e:
+            log.warning("warmup_failed", step=name, error=repr(e))
+    warmed_up.set()
+
+# ====== プロセスごとのバックグラウンド処理 ======
+# gunicorn の preload（gunicorn.conf.py）では親プロセスで import だけ行い、
+# スレッドや接続は fork 後に各ワーカーで after_fork() から始める
+PRELOADED      = os.getenv("GUNICORN_PRELOAD") == "1"
+SCHEDULER_LOCK = os.getenv("SCHEDULER_LOCK", "")  # 指定するとロックを取った1プロセスだけでスケジューラを動かす
+
+def start_background():
+    log.start()
+    if journal is not None:
+        journal.start()
+    if spool is not None:
+        spool.start()
+    prober.start()
+    atexit.register(shutdown)
+    if WARMUP:
+        threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    else:
+        warmed_up.set()
+    # APScheduler の読み込みは最初の Webhook を待たせないよう別スレッドで行う
+    if SCHEDULER_LOCK:
+        threading.Thread(target=start_scheduler_when_leader, args=(SCHEDULER_LOCK,), name="scheduler-leader", daemon=True).start()
+    else:
+        threading.Thread(target=start_scheduler, name="scheduler-start", daemon=True).start()
+
+def after_fork():
+    # 親から引き継いだ接続は使わない
+    line_bot_api.http_client.reset()
+    smtp_pool.discard()
+    intake_store.reopen()
+    restore_state()
+    start_background()
+
+# ====== 依存先の定期チェック（/ready） ======
+# /ready はここで覚えておいた結果を返すだけ（LINE / SMTP へは READY_INTERVAL 秒に1回しかつながない）
+READY_INTERVAL = float(os.getenv("READY_INTERVAL", "15"))
+READY_REQUIRED = [c.strip() for c in os.getenv("READY_REQUIRED", "line,smtp").split(",") if c.strip()]
+
+def check_queues():
+    return {
+        "journal":  journal.pending() if journal else 0,
+        "log":      log.pending(),
+        "log_dropped": log.dropped,
+        "inflight": _inflight,
+    }
 
-scheduler = BackgroundScheduler(timezone="Asia/Tokyo")
-scheduler.add_job(schedule_daily_followup, 'cron', hour=9, minute=0)
-scheduler.start()
+def check_spool():
+    if spool is None:
+        return {"enabled": False}
+    return {"enabled": True, "backlog": spool.backlog(), "dead": spool.dead_letters(), "sender": spool.is_sender()}
+
+def check_scheduler():
+    running = scheduler is not None and scheduler.running
+    return {"leader": running, "lock": SCHEDULER_LOCK or None}
+
+def check_line():
+    line_bot_api.get_bot_info()  # プールの接続を使うので新しい接続は張らない
+    return line_bot_api.http_client.pool_stats()
+
+def check_smtp():
+    with smtp_pool.connection() as smtp:
+        code = smtp.noop()[0]
+    if code != 250:
+        raise OSError(f"NOOP {code}")
+    return {"idle": smtp_pool.idle()}
+
+def check_templates():
+    catalog.refresh()
+    if catalog.errors:
+        raise ValueError(catalog.errors)
+    return {"loaded": len(catalog.load_all()), "reloads": catalog.reloads}
+
+def check_questionnaire():
+    questionnaires.refresh()
+    if questionnaires.error:
+        raise ValueError(questionnaires.error)
+    return {"version": questionnaires.current.version, "versions": len(questionnaires.versions),
+            "reloads": questionnaires.reloads}
+
+prober = HealthProber(READY_INTERVAL)
+for _name, _check in (("queues", check_queues), ("spool", check_spool), ("scheduler", check_scheduler),
+                      ("line", check_line), ("smtp", check_smtp), ("templates", check_templates),
+                      ("questionnaire", check_questionnaire)):
+    prober.add(_name, _check)
+
+# ====== 終了処理（再デプロイ時の SIGTERM） ======
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))  # gunicorn の graceful_timeout より短く
+
+draining        = threading.Event()
+_inflight       = 0
+_inflight_cond  = threading.Condition()
+_shutdown_lock  = threading.Lock()
+
+def track_inflight(f):
+    """処理中の Webhook を数える。終了処理が始まったら新しい Webhook は 503 で断る"""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        global _inflight
+        with _inflight_cond:
+            if draining.is_set():
+                return "shutting down", 503
+            _inflight += 1
+        try:
+            return f(*args, **kwargs)
+        finally:
+            with _inflight_cond:
+                _inflight -= 1
+                if not _inflight:
+                    _inflight_cond.notify_all()
+    return wrapper
+
+def _stop_scheduler():
+    try:
+        scheduler.shutdown(wait=True)
+    except Exception:
+        pass
+
+def shutdown(timeout=None):
+    """受付停止 → 処理中の Webhook を待つ → スケジューラ停止 → 送信待ちを送る → ステートを保存"""
+    if not _shutdown_lock.acquire(blocking=False):
+        return
+    started  = monotonic()
+    deadline = started + (SHUTDOWN_TIMEOUT if timeout is None else timeout)
+    prober.stop()
+    with _inflight_cond:
+        draining.set()
+        _inflight_cond.wait_for(lambda: not _inflight, timeout=max(0.0, deadline - monotonic()))
+        unfinished = _inflight
+    if scheduler is not None:
+        # 実行中のフォローアップは draining を見て抜けるのを待つ。送信が詰まっていても残り時間までしか待たない
+        stopper = threading.Thread(target=_stop_scheduler, name="scheduler-shutdown", daemon=True)
+        stopper.start()
+        stopper.join(max(0.0, deadline - monotonic()))
+    backlog = 0
+    if spool is not None:
+        spool.stop()
+        backlog = spool.drain(deadline)  # 送れなかったものはディスクに残り、次の起動で送る
+    if journal is not None:
+        try:
+            journal.compact()  # メモリ上の状態をそのまま書くので close の前でよい（再生は冪等）
+        except JournalLocked as e:
+            log.warning("journal_locked", error=str(e))  # 起動できなかったプロセスは書かない
+        journal.close()
+    intake_store.close()
+    log.info("shutdown_done", inflight=unfinished, spool_backlog=backlog,
+             seconds=round(monotonic() - started, 3))
+    log.close()
+
+if PRELOADED:
+    warm_replies()  # 定型メッセージは親で組み立てて各ワーカーと共有する
+else:
+    start_background()
 
 # ====== ルーティング ======
 @app.route("/callback", methods=["POST"])
+@track_inflight
+@WEBHOOK_SECONDS.timed(stage="total")
 def callback():
     signature = request.headers.get("X-Line-Signature")
-    body      = request.get_data(as_text=True)
+    # 大きすぎる本文は読む前に弾く（chunked は MAX_CONTENT_LENGTH で打ち切り）
+    if request.content_length is not None and request.content_length > MAX_WEBHOOK_BODY:
+        WEBHOOK_REQUESTS.inc(status="413")
+        abort(413)
+    body = request.get_data(cache=False)  # bytes のまま署名検証・JSON パース
     try:
-        handler.handle(body, signature)
+        if isinstance(handler, FastWebhookHandler):
+            with WEBHOOK_SECONDS.time(stage="verify"):
+                handler.verify(body, signature)
+            with WEBHOOK_SECONDS.time(stage="parse"):
+                payload = json.loads(body)
+            if recorder is not None:
+                recorder.record(payload, signature)
+            with WEBHOOK_SECONDS.time(stage="dispatch"):
+                handler.dispatch(payload)
+        else:
+            with WEBHOOK_SECONDS.time(stage="sdk_handle"):
+                handler.handle(body.decode("utf-8"), signature)
+            if recorder is not None:
+                recorder.record(json.loads(body), signature)
     except InvalidSignatureError:
+        WEBHOOK_REQUESTS.inc(status="400")
+        log.warning("invalid_signature", body_bytes=len(body))
         abort(400)
+    WEBHOOK_REQUESTS.inc(status="200")
     return "OK"
 
 @app.route("/admin/reset", methods=["POST"])
+@require_admin
 def admin_reset():
+    """回答中・完了済みの状態と保存した問診をすべて消す（検索・一覧と問診 DB を食い違わせない）"""
     user_states.clear()
+    session_steps.clear()
     completed_users.clear()
+    intake_store.clear()
+    intake_search.clear()
     greeted_users.clear()
     released_users.clear()
+    record("reset")
+    funnel.forget()
     return "All states reset", 200
 
+@app.route("/admin/funnel", methods=["GET"])
+@require_admin
+def admin_funnel():
+    try:
+        days = max(1, min(int(request.args.get("days", "7")), funnel.keep_days))
+    except ValueError:
+        return jsonify({"error": "days は整数で指定してください"}), 400
+    return jsonify(funnel.report(days))
+
+@app.route("/admin/questionnaire", methods=["GET"])
+@require_admin
+def admin_questionnaire():
+    return jsonify(questionnaires.describe())
+
+@app.route("/admin/questionnaire/reload", methods=["POST"])
+@require_admin
+def admin_questionnaire_reload():
+    """QUESTIONNAIRE_CHECK_INTERVAL=0 のときや、すぐに反映したいとき用"""
+    questionnaires.refresh()
+    if questionnaires.error:
+        return jsonify(questionnaires.describe()), 400
+    return jsonify(questionnaires.describe())
+
+def page_limit():
+    return max(1, min(int(request.args.get("limit", "50")), 200))
+
+def iso(ts):
+    return datetime.fromtimestamp(ts).isoformat(timespec="seconds")
+
+@app.route("/admin/sessions", methods=["GET"])
+@require_admin
+def admin_sessions():
+    step = request.args.get("step")
+    if not step:
+        return jsonify({"steps": session_steps.counts()})
+    try:
+        rows, cursor = session_steps.page(step, request.args.get("cursor"), page_limit())
+    except (InvalidCursor, ValueError):
+        return jsonify({"error": "cursor / limit が不正です"}), 400
+    items = [{"user_id": uid, "since": iso(since)} for since, uid in rows]
+    return jsonify({"step": step, "items": items, "next_cursor": cursor})
+
+@app.route("/admin/completed", methods=["GET"])
+@require_admin
+def admin_completed():
+    # from / to は日付（YYYY-MM-DD、to の日を含む）。order=desc で新しい順
+    try:
+        lo = request.args.get("from")
+        hi = request.args.get("to")
+        lo = datetime.strptime(lo, "%Y-%m-%d").timestamp() if lo else None
+        hi = (datetime.strptime(hi, "%Y-%m-%d") + timedelta(days=1)).timestamp() if hi else None
+        rows, cursor = completed_users.index.page(
+            request.args.get("cursor"), page_limit(), lo, hi, reverse=request.args.get("order") == "desc")
+    except (InvalidCursor, ValueError):
+        return jsonify({"error": "from / to / cursor / limit が不正です"}), 400
+    items = [{"user_id": uid, "finished_at": iso(ts)} for ts, uid in rows]
+    return jsonify({"items": items, "next_cursor": cursor})
+
+def intake_records(since=None, until=None):
+    """完了日時順に (user_id, 完了日時, 回答) を返す。DB から少しずつ読むので全件を一度に持たない"""
+    for intake in intake_store.iter_range(since, until):
+        yield intake["user_id"], intake["finished_at"], intake["answers"]
+
+def intake_json(intake):
+    return {
+        "id":               intake["id"],
+        "user_id":          intake["user_id"],
+        "finished_at":      intake["finished_at"].isoformat(timespec="seconds"),
+        "status":           intake["status"],
+        "followup_sent_at": intake["followup_sent_at"].isoformat(timespec="seconds") if intake["followup_sent_at"] else None,
+        "nickname":         intake["nickname"],
+        "summary":          build_summary(dict(intake["answers"])),  # 保存した回答から作り直す
+    }
+
+@app.route("/admin/intakes/<int:intake_id>", methods=["GET"])
+@require_admin
+def admin_intake(intake_id):
+    intake = intake_store.get(intake_id)
+    if intake is None:
+        return jsonify({"error": "not found"}), 404
+    return jsonify({**intake_json(intake), "answers": intake["answers"]})
+
+@app.route("/admin/export", methods=["GET"])
+@require_admin
+def admin_export():
+    # format=csv（既定）/ xlsx、from・to は完了日（YYYY-MM-DD、to の日を含む）
+    fmt = request.args.get("format", "csv")
+    try:
+        lo = request.args.get("from")
+        hi = request.args.get("to")
+        lo = datetime.strptime(lo, "%Y-%m-%d") if lo else None
+        hi = datetime.strptime(hi, "%Y-%m-%d") + timedelta(days=1) if hi else None
+    except ValueError:
+        return jsonify({"error": "from / to は YYYY-MM-DD で指定してください"}), 400
+    name    = f"intakes-{datetime.now():%Y%m%d-%H%M}.{fmt}"
+    records = intake_records(lo, hi)
+    if fmt == "csv":
+        return Response(iter_csv(records), mimetype="text/csv; charset=utf-8",
+                        headers={"Content-Disposition": f"attachment; filename={name}"})
+    if fmt == "xlsx":
+        import tempfile
+        # zip の末尾を書くまで送れないので、一時ファイル（1MB を超えたらディスク）に書いてから返す
+        tmp = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        write_xlsx(records, tmp)
+        tmp.seek(0)
+        return send_file(tmp, as_attachment=True, download_name=name,
+                         mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    return jsonify({"error": "format は csv か xlsx です"}), 400
+
+@app.route("/admin/search", methods=["GET"])
+@require_admin
+def admin_search():
+    # q: お名前・フリガナの一部（ひらがな/カタカナどちらでも） / phone: 電話番号の末尾4桁以上 / from・to: 完了日
+    try:
+        lo = request.args.get("from")
+        hi = request.args.get("to")
+        hits = intake_search.search(
+            request.args.get("q"), request.args.get("phone"),
+            datetime.strptime(lo, "%Y-%m-%d").timestamp() if lo else None,
+            (datetime.strptime(hi, "%Y-%m-%d") + timedelta(days=1)).timestamp() if hi else None,
+            page_limit(),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    items = [{"user_id": i.user_id, "finished_at": iso(i.finished_at), "name": i.name, "kana": i.kana, "phone": i.phone}
+             for i in hits]
+    return jsonify({"items": items})
+
+@app.route("/admin/users/<user_id>", methods=["GET"])
+@require_admin
+def admin_user(user_id):
+    version, state = user_states.read(user_id)
+    done    = completed_users.get(user_id)
+    intakes = intake_store.for_user(user_id)
+    if not version and done is None and not intakes and user_id not in greeted_users and user_id not in released_users:
+        return jsonify({"error": "not found"}), 404
+    since = session_steps.key(user_id)
+    return jsonify({
+        "user_id":   user_id,
+        "session":   {"version": version, "step": session_steps.group(user_id),
+                      "since": iso(since) if since else None, "answers": state} if version else None,
+        "completed": {"finished_at": done[0].isoformat(timespec="seconds"), "summary": done[1]} if done else None,
+        "intakes":   [intake_json(i) for i in intakes],
+        "greeted":   user_id in greeted_users,
+        "released":  user_id in released_users,
+    })
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
 @app.route("/ping", methods=["GET","HEAD"])
 def ping():
+    if not warmed_up.is_set():
+        return "warming up", 503
     return "pong", 200
 
+@app.route("/ready", methods=["GET"])
+def ready():
+    checks = prober.snapshot()
+    stale  = READY_INTERVAL * 3  # チェックのスレッドが止まっていたら古い結果を信じない
+    failed = [name for name in READY_REQUIRED
+              if name in checks and not (checks[name]["ok"] and checks[name]["age"] is not None and checks[name]["age"] <= stale)]
+    status = "ready"
+    if draining.is_set():
+        status = "draining"
+    elif not warmed_up.is_set():
+        status = "warming_up"
+    elif failed:
+        status = "degraded"
+    body = {"status": status, "failed": failed, "checks": checks}
+    return jsonify(body), 200 if status == "ready" else 503
+
 if __name__ == "__main__":
+    import signal
+    # SIGTERM でも atexit の終了処理が走るように
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run()
\ No newline at end of file
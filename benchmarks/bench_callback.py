@@ -0,0 +1,53 @@
+"""callback() の本文処理: 署名検証 + JSON パース
+
+従来: get_data(as_text=True) -> SDK が encode して HMAC -> str を json.loads
+現在: bytes のまま鍵入り HMAC を copy() して検証 -> bytes を json.loads
+
+    python benchmarks/bench_callback.py --events 10 100 500
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from bench_router import SECRET, make_events  # noqa: E402
+from fast_router import FastWebhookHandler  # noqa: E402
+
+
+def legacy(raw, signature):
+    body = raw.decode("utf-8")  # request.get_data(as_text=True)
+    gen = hmac.new(SECRET.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    if not hmac.compare_digest(signature.encode("utf-8"), base64.b64encode(gen)):
+        raise ValueError("signature")
+    return json.loads(body)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, nargs="+", default=[10, 100, 500])
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    fast = FastWebhookHandler(SECRET)
+
+    def current(raw, signature):
+        fast.verify(raw, signature)
+        return json.loads(raw)
+
+    print(f"{'events':>6} {'bytes':>9} {'legacy us':>10} {'current us':>11} {'speedup':>8}")
+    for n in args.events:
+        raw = json.dumps({"destination": "Uxxxx", "events": make_events(n)}, ensure_ascii=False).encode()
+        sig = base64.b64encode(hmac.new(SECRET.encode(), raw, hashlib.sha256).digest()).decode()
+        number = max(20, 20000 // n)
+        t_old = min(timeit.repeat(lambda: legacy(raw, sig), number=number, repeat=args.repeat)) / number
+        t_new = min(timeit.repeat(lambda: current(raw, sig), number=number, repeat=args.repeat)) / number
+        print(f"{n:>6} {len(raw):>9} {t_old * 1e6:>10.1f} {t_new * 1e6:>11.1f} {t_old / t_new:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""コールドスタート: プロセス起動から /callback が初めて 200 を返すまで
+
+スリープ明けの Render と同じく、最初の Webhook がインタープリタ起動と import を待つ時間を測る。
+LINE / SMTP は代替サーバー（mock_line_api / mock_smtp）を使う。
+
+    python benchmarks/bench_coldstart.py --runs 5
+    python benchmarks/bench_coldstart.py --app-cmd "gunicorn -b 127.0.0.1:5000 app:app"
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import mock_line_api  # noqa: E402
+import mock_smtp  # noqa: E402
+from loadtest import make_event, sign  # noqa: E402
+
+SECRET = "coldstart-secret"
+
+
+def first_200(url, deadline, interval=0.005):
+    """接続できるようになるまで署名付きの follow を送り続ける"""
+    session = requests.Session()
+    while time.perf_counter() < deadline:
+        event = make_event("follow", "U" + "c" * 32, None)
+        body  = json.dumps({"destination": "Ubot", "events": [event]}).encode("utf-8")
+        try:
+            r = session.post(url, data=body, timeout=10,
+                             headers={"Content-Type": "application/json", "X-Line-Signature": sign(SECRET, body)})
+            if r.status_code == 200:
+                return True
+        except requests.ConnectionError:
+            pass
+        time.sleep(interval)
+    return False
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--url", default="http://127.0.0.1:5000/callback")
+    ap.add_argument("--app-cmd", default=f"{sys.executable} app.py")
+    ap.add_argument("--line-port", type=int, default=8081)
+    ap.add_argument("--smtp-port", type=int, default=2525)
+    ap.add_argument("--timeout", type=float, default=60.0)
+    args = ap.parse_args()
+
+    from werkzeug.serving import make_server
+    line = make_server("127.0.0.1", args.line_port, mock_line_api.create_app(), threaded=True)
+    threading.Thread(target=line.serve_forever, name="mock-line", daemon=True).start()
+    mock_smtp.start_in_thread(port=args.smtp_port)
+
+    env = dict(os.environ)
+    env.update({
+        "LINE_API_ENDPOINT":         f"http://127.0.0.1:{args.line_port}",
+        "LINE_CHANNEL_SECRET":       SECRET,
+        "LINE_CHANNEL_ACCESS_TOKEN": "coldstart",
+        "SMTP_HOST":                 "127.0.0.1",
+        "SMTP_PORT":                 str(args.smtp_port),
+    })
+
+    results = []
+    for i in range(args.runs):
+        started = time.perf_counter()
+        app = subprocess.Popen(args.app_cmd.split(), env=env, cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            ok = first_200(args.url, started + args.timeout)
+            elapsed = (time.perf_counter() - started) * 1000.0
+        finally:
+            app.terminate()
+            app.wait(timeout=30)
+        if not ok:
+            raise SystemExit(f"run {i + 1}: no 200 within {args.timeout}s")
+        results.append(elapsed)
+        print(f"run {i + 1}: {elapsed:.0f} ms")
+
+    print(f"spawn -> first 200: min {min(results):.0f} ms  median {statistics.median(results):.0f} ms  max {max(results):.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""問診のホットパスのマイクロベンチマーク
+
+    get_next_question（ステップごと）
+    handle_text / handle_postback の全分岐
+    send_buttons の Flex ペイロード組み立て
+    build_summary（finalize_response のサマリー）
+    render[...]（テンプレートカタログの文面ごと、コンパイル済みを呼ぶだけ）
+    followup_targets（10k / 100k 件の完了ユーザーから抽出）
+
+LINE API 呼び出しは記録だけするダミーに差し替えて、アプリ内の処理だけを測る。
+メモリは tracemalloc で1回あたりの確保ピークと残存量を出す。
+
+    python benchmarks/bench_hotpaths.py --save benchmarks/baseline.json
+    python benchmarks/bench_hotpaths.py --compare benchmarks/baseline.json
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "benchmark")
+os.environ.setdefault("LINE_CHANNEL_SECRET", "benchmark")
+os.environ.setdefault("WARMUP", "0")
+import app  # noqa: E402
+
+UID = "U" + "0" * 32
+
+
+class NullLineBotApi:
+    def reply_message(self, reply_token, messages, *args, **kwargs):
+        pass
+
+    def push_message(self, to, messages, *args, **kwargs):
+        pass
+
+    def get_profile(self, user_id, *args, **kwargs):
+        return SimpleNamespace(display_name="ベンチマーク")
+
+    def get_bot_info(self, *args, **kwargs):
+        return SimpleNamespace(display_name="ベンチマーク")
+
+
+# ====== 回答が揃っていく途中のステート ======
+ANSWERS = [
+    ("都道府県", "東京都"), ("お名前", "山田 花子"), ("フリガナ", "ヤマダ ハナコ"),
+    ("電話番号", "09012345678"), ("生年月日_年", 1990), ("生年月日_月", 4), ("生年月日_日", 15),
+    ("性別", "女"), ("身長", "160"), ("体重", "50"),
+    ("アルコール", "いいえ"), ("副腎皮質ホルモン剤", "いいえ"), ("がん", "いいえ"), ("糖尿病", "いいえ"),
+    ("その他病気", "はい"), ("病名", "高血圧"), ("お薬服用", "はい"), ("服用薬", "アムロジピン"),
+    ("アレルギー", "はい"), ("アレルギー名", "花粉"),
+]
+EXTRA = {"生年月日_日": {"生年月日": "1990-04-15", "満年齢": 36}}
+
+
+def state_before(step):
+    state = {}
+    for key, value in ANSWERS:
+        if key == step:
+            break
+        state[key] = value
+        state.update(EXTRA.get(key, {}))
+    return state
+
+
+TEXT_INPUTS = {
+    "都道府県": ("東京都", None), "お名前": ("山田 花子", None), "フリガナ": ("ヤマダ ハナコ", None),
+    "電話番号": ("09012345678", "090-1234"), "生年月日_年": ("1990", "90"), "生年月日_月": ("4", "13"),
+    "生年月日_日": ("15", "31x"), "性別": ("女", None), "身長": ("160", "999"), "体重": ("50", "5"),
+    "アルコール": ("はい", None), "病名": ("高血圧", None), "服用薬": ("アムロジピン", None),
+    "アレルギー名": ("花粉", None),
+}
+
+POSTBACK_STEP = {data: key for data, (key, _) in app.questionnaires.current.choices.items()}
+
+
+def event(text=None, data=None):
+    e = SimpleNamespace(source=SimpleNamespace(user_id=UID), reply_token="rt")
+    if text is not None:
+        e.message = SimpleNamespace(text=text)
+    if data is not None:
+        e.postback = SimpleNamespace(data=data)
+    return e
+
+
+# ====== 計測 ======
+def measure(fn, number):
+    gc.collect()
+    t = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    for _ in range(100):
+        fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    return {"us": t * 1e6, "peak_kib": peak / 1024.0, "retained_kib_per_100": retained / 1024.0}
+
+
+def bench_next_question(results):
+    for key, _ in ANSWERS:
+        state = state_before(key)
+        results[f"get_next_question[{key}]"] = measure(lambda: app.get_next_question(state), 20000)
+
+
+def bench_handle_text(results):
+    for step, (good, bad) in TEXT_INPUTS.items():
+        prepared = state_before(step)
+        for label, text in (("ok", good), ("ng", bad)):
+            if text is None:
+                continue
+
+            def run(prepared=prepared, text=text):
+                app.greeted_users.add(UID)
+                app.completed_users.pop(UID, None)
+                app.user_states[UID] = dict(prepared)
+                app.handle_text(event(text=text))
+            results[f"handle_text[{step}:{label}]"] = measure(run, 2000)
+
+    def completed():
+        app.handle_text(event(text="こんにちは"))
+    app.completed_users[UID] = (datetime.now(), "")
+    results["handle_text[完了後]"] = measure(completed, 5000)
+    del app.completed_users[UID]
+
+
+def bench_handle_postback(results):
+    for data, key in POSTBACK_STEP.items():
+        prepared = state_before(key)
+
+        def run(prepared=prepared, data=data):
+            app.completed_users.pop(UID, None)
+            app.user_states[UID] = dict(prepared)
+            app.handle_postback(event(data=data))
+        results[f"handle_postback[{data}]"] = measure(run, 2000)
+
+
+def bench_send_buttons(results):
+    _, text, buttons = app.questionnaires.current.by_key["アレルギー"].reply
+    results["send_buttons"] = measure(lambda: app.send_buttons("rt", text, buttons), 5000)
+
+
+def bench_summary(results):
+    state = state_before(None)
+    results["build_summary"] = measure(lambda: app.build_summary(dict(state)), 5000)
+
+
+def bench_templates(results):
+    state   = state_before(None)
+    summary = app.build_summary(dict(state))
+    cases = {
+        "completed.txt":           {"nickname": "山田", "summary": summary},
+        "office_mail.txt":         {"user_id": UID, "nickname": "山田", "summary": summary},
+        "office_mail_subject.txt": {},
+        "followup.txt":            {"nickname": "山田"},
+    }
+    for name, context in cases.items():
+        results[f"render[{name}]"] = measure(lambda name=name, context=context: app.catalog.render(name, **context), 5000)
+
+
+def bench_followup_targets(results):
+    now = datetime.now()
+    for n in (10000, 100000):
+        app.intake_store.clear()
+        for i in range(n):
+            finished = now - timedelta(days=i % 2)  # 半分が対象
+            app.intake_store.add(f"U{i:032x}", finished, "", {})
+        results[f"followup_targets[{n}]"] = measure(lambda: app.followup_targets(now), 5 if n > 10000 else 20)
+    app.intake_store.clear()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--save", help="結果を JSON で保存")
+    ap.add_argument("--compare", help="保存済みの結果と比較")
+    args = ap.parse_args()
+
+    app.line_bot_api = NullLineBotApi()
+    app.send_summary_email_to_office = lambda summary, user_id: None
+    app.log.stream = open(os.devnull, "w")
+    if app.scheduler is not None:
+        app.scheduler.shutdown(wait=False)
+
+    results = {}
+    for bench in (bench_next_question, bench_handle_text, bench_handle_postback,
+                  bench_send_buttons, bench_summary, bench_templates, bench_followup_targets):
+        bench(results)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    print(f"{'benchmark':<42}{'us/op':>10}{'peak KiB':>10}{'keep KiB':>10}{'vs base':>9}")
+    for name, r in results.items():
+        delta = ""
+        if name in baseline:
+            delta = f"{(r['us'] / baseline[name]['us'] - 1) * 100:+.1f}%"
+        print(f"{name:<42}{r['us']:>10.2f}{r['peak_kib']:>10.1f}{r['retained_kib_per_100']:>10.1f}{delta:>9}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
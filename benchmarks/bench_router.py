@@ -0,0 +1,86 @@
+"""Webhook のパース + 振り分け: SDK の WebhookHandler と FastWebhookHandler の比較
+
+    python benchmarks/bench_router.py --events 1 5 20 100
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from linebot import WebhookHandler  # noqa: E402
+from linebot.models import FollowEvent, MessageEvent, PostbackEvent, TextMessage  # noqa: E402
+from fast_router import FastWebhookHandler  # noqa: E402
+
+SECRET = "benchmark-channel-secret"
+
+
+def make_events(n):
+    events = []
+    for i in range(n):
+        base = {
+            "replyToken": f"{i:032x}",
+            "timestamp": 1700000000000 + i,
+            "mode": "active",
+            "webhookEventId": f"01H{i:023d}",
+            "deliveryContext": {"isRedelivery": False},
+            "source": {"type": "user", "userId": f"U{i:032x}"},
+        }
+        kind = i % 3
+        if kind == 0:
+            base.update(type="message", message={"id": str(i), "type": "text", "quoteToken": "q", "text": "東京都"})
+        elif kind == 1:
+            base.update(type="postback", postback={"data": "alcohol_no"})
+        else:
+            base.update(type="follow", follow={"isUnblocked": False})
+        events.append(base)
+    return events
+
+
+def sign(body):
+    return base64.b64encode(hmac.new(SECRET.encode(), body, hashlib.sha256).digest()).decode()
+
+
+def register(h, sink):
+    @h.add(MessageEvent, message=TextMessage)
+    def on_text(event):
+        sink.append((event.source.user_id, event.reply_token, event.message.text))
+
+    @h.add(PostbackEvent)
+    def on_postback(event):
+        sink.append((event.source.user_id, event.reply_token, event.postback.data))
+
+    @h.add(FollowEvent)
+    def on_follow(event):
+        sink.append((event.source.user_id, event.reply_token))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, nargs="+", default=[1, 5, 20, 100])
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    sink = []
+    sdk, fast = WebhookHandler(SECRET), FastWebhookHandler(SECRET)
+    register(sdk, sink)
+    register(fast, sink)
+
+    print(f"{'events':>6} {'sdk us/req':>12} {'fast us/req':>12} {'speedup':>8}")
+    for n in args.events:
+        body = json.dumps({"destination": "Uxxxx", "events": make_events(n)}, ensure_ascii=False).encode()
+        sig = sign(body)
+        text = body.decode()
+        number = max(10, 20000 // n)
+        t_sdk = min(timeit.repeat(lambda: sdk.handle(text, sig), number=number, repeat=args.repeat)) / number
+        t_fast = min(timeit.repeat(lambda: fast.handle(body, sig), number=number, repeat=args.repeat)) / number
+        sink.clear()
+        print(f"{n:>6} {t_sdk * 1e6:>12.1f} {t_fast * 1e6:>12.1f} {t_sdk / t_fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
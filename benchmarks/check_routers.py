@@ -0,0 +1,54 @@
+"""Webhook ルーター（fast / sdk）ごとに callback() が全イベント種別を 200 で返すかの確認
+
+WEBHOOK_ROUTER は app の import 時に決まるので、ルーターごとに子プロセスで動かす。
+LINE API 呼び出しは記録だけするダミーに差し替える。
+
+    python benchmarks/check_routers.py
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROUTERS = ("fast", "sdk")
+SECRET  = "check-routers"
+
+
+def run_one():
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    from bench_hotpaths import NullLineBotApi
+    import app
+    import loadtest
+
+    app.line_bot_api = NullLineBotApi()
+    app.send_summary_email_to_office = lambda summary, user_id: None
+    app.log.stream = open(os.devnull, "w")
+    client = app.app.test_client()
+    failures = 0
+    for name, kind, value in loadtest.FLOW:
+        body = json.dumps({"destination": "U", "events": [loadtest.make_event(kind, "U" + "0" * 32, value)]},
+                          ensure_ascii=False).encode("utf-8")
+        status = client.post("/callback", data=body, headers={"X-Line-Signature": loadtest.sign(SECRET, body)}).status_code
+        if status != 200:
+            failures += 1
+            print(f"  {name}: {status}")
+    return failures
+
+
+def main():
+    if os.getenv("CHECK_ROUTERS_CHILD"):
+        sys.exit(1 if run_one() else 0)
+    failed = []
+    for router in ROUTERS:
+        env = {**os.environ, "CHECK_ROUTERS_CHILD": "1", "WEBHOOK_ROUTER": router, "WARMUP": "0",
+               "LINE_CHANNEL_ACCESS_TOKEN": "check", "LINE_CHANNEL_SECRET": SECRET,
+               "STATE_DIR": "", "SPOOL_DIR": "", "INTAKE_DB": "", "SCHEDULER_LOCK": ""}
+        code = subprocess.call([sys.executable, __file__], env=env)
+        print(f"{router}: {'ok' if code == 0 else 'NG'}")
+        if code:
+            failed.append(router)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
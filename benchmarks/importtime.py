@@ -0,0 +1,78 @@
+"""app.py の import 時間レポート
+
+python -X importtime -c "import app" を別プロセスで実行し、
+トップレベルのパッケージごとの累積時間と、重いモジュールの上位を出す。
+--budget-ms を超えたら終了コード 1（デプロイ前のチェック用）。
+
+    python benchmarks/importtime.py
+    python benchmarks/importtime.py --budget-ms 800 --top 15
+"""
+import argparse
+import collections
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)$")
+
+
+def measure(python, module):
+    env = dict(os.environ)
+    env.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "importtime")
+    env.setdefault("LINE_CHANNEL_SECRET", "importtime")
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = LINE.match(line)
+        if m:
+            depth = (len(m.group(3)) - 1) // 2
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), depth))
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-2000:])
+        raise SystemExit(f"import {module} failed")
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--module", default="app")
+    ap.add_argument("--python", default=sys.executable)
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--budget-ms", type=float, default=0.0, help="app の累積 import 時間の上限（0 はチェックしない）")
+    args = ap.parse_args()
+
+    rows  = measure(args.python, args.module)
+    end   = next(i for i, r in enumerate(rows) if r[0] == args.module and r[3] == 0)
+    start = end
+    while start > 0 and rows[start - 1][3] > 0:
+        start -= 1
+    rows  = rows[start:end + 1]  # 子が先に出力されるので app の行の直前までが app 配下
+    total = rows[-1][2] / 1000.0
+
+    # app の直下で読み込まれたものをトップレベルのパッケージ単位でまとめる
+    by_package = collections.Counter()
+    for name, _, cum, depth in rows:
+        if depth == 1:
+            by_package[name.split(".")[0]] += cum
+
+    print(f"import {args.module}: {total:.1f} ms")
+    print(f"\n{'package':<28}{'cumulative ms':>14}")
+    for name, us in by_package.most_common(args.top):
+        print(f"{name:<28}{us / 1000.0:>14.1f}")
+
+    print(f"\n{'module':<44}{'self ms':>9}")
+    for name, self_us, _, _ in sorted(rows, key=lambda r: -r[1])[:args.top]:
+        print(f"{name:<44}{self_us / 1000.0:>9.1f}")
+
+    if args.budget_ms and total > args.budget_ms:
+        print(f"\nover budget: {total:.1f} ms > {args.budget_ms:.1f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
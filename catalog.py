@@ -0,0 +1,84 @@
+"""文面テンプレート（Jinja2）のカタログ
+
+サマリー・事務局メール・フォローアップなどの文面を templates/ のファイルに置き、
+コンパイル済みのテンプレートを名前ごとに持っておく。render() はそれを呼ぶだけ。
+
+check_interval 秒に1回だけファイルの更新時刻を確かめ、変わっていれば読み直す
+（Jinja2 の auto_reload は render のたびに stat するので使わない）。
+読み直したテンプレートに文法エラーがあれば、前のものを使い続けて errors に残す。
+
+    catalog = TemplateCatalog("templates")
+    catalog.render("followup.txt", nickname="山田")
+"""
+import os
+import threading
+import time
+
+from jinja2 import Environment, FileSystemLoader, StrictUndefined, TemplateError
+
+
+class TemplateCatalog:
+    def __init__(self, directory, check_interval=2.0):
+        self.directory      = directory
+        self.check_interval = check_interval  # 0 なら読み直さない
+        self.env = Environment(
+            loader=FileSystemLoader(directory),
+            autoescape=False,         # LINE・メールのプレーンテキスト
+            trim_blocks=True,
+            lstrip_blocks=True,
+            undefined=StrictUndefined,
+            auto_reload=False,
+            cache_size=0,             # キャッシュは self._compiled で持つ
+        )
+        self.reloads     = 0
+        self.errors      = {}  # 名前 -> 読み直しに失敗したときのエラー
+        self._compiled   = {}  # 名前 -> (Template, 更新時刻)
+        self._next_check = 0.0
+        self._lock       = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _compile(self, name):
+        mtime = os.stat(self._path(name)).st_mtime_ns
+        with open(self._path(name), encoding="utf-8") as f:
+            source = f.read()
+        return self.env.from_string(source), mtime
+
+    def get(self, name):
+        if self.check_interval and time.monotonic() >= self._next_check:
+            self.refresh()
+        entry = self._compiled.get(name)
+        if entry is None:
+            with self._lock:
+                entry = self._compiled.get(name)
+                if entry is None:
+                    entry = self._compiled[name] = self._compile(name)
+        return entry[0]
+
+    def render(self, name, **context):
+        # ループの最後の行の改行は文面に含めない
+        return self.get(name).render(**context).rstrip("\n")
+
+    def refresh(self):
+        """更新されたファイルを読み直す。読み直した件数を返す"""
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+            changed = 0
+            for name, (template, mtime) in list(self._compiled.items()):
+                try:
+                    if os.stat(self._path(name)).st_mtime_ns == mtime:
+                        continue
+                    self._compiled[name] = self._compile(name)
+                    self.errors.pop(name, None)
+                    changed += 1
+                except (OSError, TemplateError) as e:
+                    self.errors[name] = repr(e)
+            self.reloads += changed
+            return changed
+
+    def load_all(self):
+        """templates/ の全ファイルを先にコンパイルしておく（起動時）"""
+        for name in sorted(self.env.list_templates()):
+            self.get(name)
+        return sorted(self._compiled)
@@ -0,0 +1,129 @@
+"""キュー経由の構造化ログ（JSON Lines）
+
+ハンドラ側は log.info("msg", user=uid) で deque に1回 append するだけ（ロックも通知もなし）。
+書き込みスレッドが flush_interval ごとにまとめて JSON Lines で出力する。
+イベントごとの相関ID（contextvars）を自動で付け、量の多いイベントは間引ける。
+
+    {"ts":"2025-01-01T09:00:00.123+09:00","level":"info","event":"msg","cid":"01H…","user":"U…"}
+"""
+import collections
+import contextvars
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+# webhookEventId が無いときの採番（毎回 urandom を読むと遅い環境があるので連番）
+_cid_prefix = os.urandom(4).hex()
+_cid_seq    = itertools.count(1)
+
+
+def _reseed_correlation_ids():
+    # fork したワーカー同士で ID が重ならないように
+    global _cid_prefix, _cid_seq
+    _cid_prefix = os.urandom(4).hex()
+    _cid_seq    = itertools.count(1)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reseed_correlation_ids)
+
+
+def new_correlation_id(value=None):
+    cid = value or f"{_cid_prefix}-{next(_cid_seq):x}"
+    correlation_id.set(cid)
+    return cid
+
+
+def parse_sample_rates(spec):
+    """"msg=0.1,postback=0.5" -> {"msg": 0.1, "postback": 0.5}"""
+    rates = {}
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        name, _, rate = part.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class EventLog:
+    def __init__(self, stream=None, sample=None, maxsize=50000, batch_size=512, flush_interval=0.2):
+        self.stream         = stream or sys.stdout
+        self.sample         = dict(sample or {})
+        self.batch_size     = batch_size
+        self.flush_interval = flush_interval
+        self.maxsize        = maxsize
+        self.dropped        = 0  # キューあふれで捨てた件数
+        self._queue         = collections.deque()
+        self._stop          = threading.Event()
+        self._thread        = None
+
+    # ====== ホットパス ======
+    def log(self, level, event, **fields):
+        rate = self.sample.get(event)
+        if rate is not None and random.random() >= rate:
+            return
+        if len(self._queue) >= self.maxsize:
+            self.dropped += 1
+            return
+        self._queue.append((time.time(), level, event, correlation_id.get(), fields))
+
+    def info(self, event, **fields):
+        self.log("info", event, **fields)
+
+    def warning(self, event, **fields):
+        self.log("warning", event, **fields)
+
+    def error(self, event, **fields):
+        self.log("error", event, **fields)
+
+    def pending(self):
+        return len(self._queue)
+
+    # ====== 書き込みスレッド ======
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._writer, name="eventlog", daemon=True)
+            self._thread.start()
+        return self
+
+    def _writer(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        q = self._queue
+        while q:
+            items = []
+            while q and len(items) < self.batch_size:
+                items.append(q.popleft())
+            try:
+                self.stream.write("\n".join(self._format(i) for i in items) + "\n")
+                self.stream.flush()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _format(item):
+        ts, level, event, cid, fields = item
+        rec = {
+            "ts":    datetime.fromtimestamp(ts).astimezone().isoformat(timespec="milliseconds"),
+            "level": level,
+            "event": event,
+        }
+        if cid:
+            rec["cid"] = cid
+        rec.update(fields)
+        return json.dumps(rec, ensure_ascii=False, default=str, separators=(",", ":"))
+
+    def close(self, timeout=5.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
@@ -0,0 +1,143 @@
+"""完了した問診の書き出し（CSV / Excel）
+
+行はジェネレータで1件ずつ作って書き出すので、期間がどれだけ長くてもメモリは一定。
+Excel は openpyxl の write_only モード（行はその場で一時ファイルへ書かれる）。
+lxml が入っていないと openpyxl はシート全体をメモリに組み立てるので、lxml も必ず入れる。
+値は患者の自由入力を含むので、すべて文字列のセルとして書き、= + - @ などで始まるものには ' を付ける
+（数式として実行されないように）。
+
+    python export.py --db /var/data/intakes.sqlite3 --from 2025-01-01 --to 2025-03-31 -o intakes.xlsx
+    python export.py --format csv > intakes.csv          # INTAKE_DB か STATE_DIR/intakes.sqlite3
+"""
+import argparse
+import csv
+import io
+import itertools
+import os
+import sys
+from datetime import datetime, timedelta
+
+# finalize_response（build_summary）と同じ並び
+FIELDS = [
+    "都道府県", "お名前", "フリガナ", "電話番号",
+    "生年月日", "性別", "身長", "体重",
+    "アルコール", "副腎皮質ホルモン剤", "がん", "糖尿病", "その他病気",
+    "病名", "お薬服用", "服用薬", "アレルギー", "アレルギー名",
+]
+HEADER = ["ユーザーID", "完了日時"] + FIELDS
+
+# Excel などが数式として解釈する先頭文字（患者の自由入力が数式として実行されないようにする）
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def parse_summary(summary):
+    """サマリー文字列を {項目: 値} に戻す（「お名前: 山田 花子（ヤマダ ハナコ）」は2項目に分ける）
+
+    回答を保存するようになる前に完了していた分を取り込むときに使う。
+    """
+    answers = {}
+    for line in summary.splitlines():
+        key, sep, value = line.partition(": ")
+        if not sep:
+            continue
+        if key == "お名前" and value.endswith("）") and "（" in value:
+            value, answers["フリガナ"] = value[:-1].split("（", 1)
+        if key in ("身長", "体重"):
+            value = value.rsplit(" ", 1)[0]  # 単位（cm / kg）は build_summary が付け直す
+        answers[key] = value
+    return answers
+
+
+def cell(value):
+    """値を文字列にし、数式と解釈される先頭文字で始まるものは ' を付けて無害にする"""
+    text = "" if value is None else str(value)
+    return "'" + text if text.startswith(FORMULA_PREFIXES) else text
+
+
+def rows(records):
+    """records: (user_id, 完了日時 datetime, {項目: 値}) の iterable。値はすべて cell() 済みの文字列"""
+    for user_id, finished_at, answers in records:
+        yield [cell(user_id), finished_at.strftime("%Y-%m-%d %H:%M:%S")] + [cell(answers.get(k, "")) for k in FIELDS]
+
+
+def iter_csv(records, chunk_size=64 * 1024):
+    """CSV を chunk_size 文字程度ずつ返す（先頭に BOM を付けて Excel でも文字化けしないように）"""
+    buf    = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write("\ufeff")
+    for row in itertools.chain([HEADER], rows(records)):
+        writer.writerow(row)
+        if buf.tell() >= chunk_size:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def write_xlsx(records, fileobj):
+    from openpyxl import Workbook  # 書き出すときだけ読み込む
+    from openpyxl.cell import WriteOnlyCell
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("問診")
+
+    def strings(values):
+        # 型を推測させず、すべて文字列のセルとして書く（"=..." を数式にしない）
+        out = []
+        for value in values:
+            c = WriteOnlyCell(ws, value)
+            c.data_type = "s"
+            out.append(c)
+        return out
+
+    ws.append(strings(HEADER))
+    for row in rows(records):
+        ws.append(strings(row))
+    wb.save(fileobj)
+
+
+# ====== CLI（問診の DB から読む） ======
+def load_intakes(path, since=None, until=None):
+    from intakes import IntakeStore
+
+    store = IntakeStore(path)
+    try:
+        for intake in store.iter_range(since, until):
+            yield intake["user_id"], intake["finished_at"], intake["answers"]
+    finally:
+        store.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    state_dir = os.getenv("STATE_DIR", "")
+    ap.add_argument("--db", default=os.getenv("INTAKE_DB") or (os.path.join(state_dir, "intakes.sqlite3") if state_dir else ""))
+    ap.add_argument("--format", choices=["csv", "xlsx"])
+    ap.add_argument("--from", dest="since", help="YYYY-MM-DD")
+    ap.add_argument("--to", dest="until", help="YYYY-MM-DD（この日を含む）")
+    ap.add_argument("-o", "--output", default="-")
+    args = ap.parse_args()
+    if not args.db or not os.path.exists(args.db):
+        ap.error("--db（または INTAKE_DB / STATE_DIR）で問診の DB を指定してください")
+
+    fmt   = args.format or ("xlsx" if args.output.endswith(".xlsx") else "csv")
+    since = datetime.strptime(args.since, "%Y-%m-%d") if args.since else None
+    until = datetime.strptime(args.until, "%Y-%m-%d") + timedelta(days=1) if args.until else None
+    records = load_intakes(args.db, since, until)
+
+    if fmt == "xlsx":
+        if args.output == "-":
+            ap.error("xlsx は -o でファイルを指定してください")
+        write_xlsx(records, args.output)
+        return
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+    try:
+        for chunk in iter_csv(records):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
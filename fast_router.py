@@ -0,0 +1,161 @@
+"""軽量 Webhook ルーター
+
+WebhookHandler と同じ @handler.add(...) で登録できるが、
+SDK のモデル（Event / Message / Source）は組み立てず、
+JSON を一度だけ読んで type 文字列の dict でハンドラへ振り分ける。
+ハンドラには app.py が使う属性だけを持つ軽いビューを渡す。
+
+    event.source.user_id / event.reply_token
+    event.message.text   / event.postback.data / event.type
+"""
+import base64
+import hashlib
+import hmac
+import inspect
+import json
+import logging
+
+from linebot.exceptions import InvalidSignatureError
+
+LOGGER = logging.getLogger(__name__)
+
+# SDK のクラス名 -> Webhook の type
+EVENT_TYPES = {
+    "MessageEvent":           "message",
+    "FollowEvent":            "follow",
+    "UnfollowEvent":          "unfollow",
+    "JoinEvent":              "join",
+    "LeaveEvent":             "leave",
+    "PostbackEvent":          "postback",
+    "BeaconEvent":            "beacon",
+    "AccountLinkEvent":       "accountLink",
+    "MemberJoinedEvent":      "memberJoined",
+    "MemberLeftEvent":        "memberLeft",
+    "ThingsEvent":            "things",
+    "UnsendEvent":            "unsend",
+    "VideoPlayCompleteEvent": "videoPlayComplete",
+}
+MESSAGE_TYPES = {
+    "TextMessage":     "text",
+    "ImageMessage":    "image",
+    "VideoMessage":    "video",
+    "AudioMessage":    "audio",
+    "LocationMessage": "location",
+    "StickerMessage":  "sticker",
+    "FileMessage":     "file",
+}
+
+
+# ====== 軽量ビュー ======
+class SourceView:
+    __slots__ = ("type", "user_id", "group_id", "room_id")
+
+    def __init__(self, raw):
+        self.type     = raw.get("type")
+        self.user_id  = raw.get("userId")
+        self.group_id = raw.get("groupId")
+        self.room_id  = raw.get("roomId")
+
+
+class MessageView:
+    __slots__ = ("type", "id", "text")
+
+    def __init__(self, raw):
+        self.type = raw.get("type")
+        self.id   = raw.get("id")
+        self.text = raw.get("text")
+
+
+class PostbackView:
+    __slots__ = ("data", "params")
+
+    def __init__(self, raw):
+        self.data   = raw.get("data")
+        self.params = raw.get("params")
+
+
+class EventView:
+    __slots__ = ("raw", "type", "timestamp", "reply_token", "webhook_event_id", "source", "message", "postback")
+
+    def __init__(self, raw):
+        self.raw              = raw
+        self.type             = raw.get("type")
+        self.timestamp        = raw.get("timestamp")
+        self.reply_token      = raw.get("replyToken")
+        self.webhook_event_id = raw.get("webhookEventId")
+        src = raw.get("source")
+        self.source   = SourceView(src) if src is not None else None
+        msg = raw.get("message")
+        self.message  = MessageView(msg) if msg is not None else None
+        pb = raw.get("postback")
+        self.postback = PostbackView(pb) if pb is not None else None
+
+
+def _type_name(obj, table):
+    if obj is None or isinstance(obj, str):
+        return obj
+    return table.get(obj.__name__, obj.__name__)
+
+
+def _wants_destination(func):
+    try:
+        return len(inspect.signature(func).parameters) >= 2
+    except (TypeError, ValueError):
+        return False
+
+
+# ====== ルーター ======
+class FastWebhookHandler:
+    def __init__(self, channel_secret):
+        self.channel_secret = (channel_secret or "").encode("utf-8")
+        # 鍵を入れた HMAC を一度だけ作り、リクエストごとに copy() する
+        self._mac      = hmac.new(self.channel_secret, digestmod=hashlib.sha256)
+        self._handlers = {}  # (event type, message type or None) -> (func, 2引数か)
+        self._default  = None
+
+    def add(self, event, message=None):
+        def decorator(func):
+            etype    = _type_name(event, EVENT_TYPES)
+            messages = message if isinstance(message, (list, tuple)) else [message]
+            for m in messages:
+                self._handlers[(etype, _type_name(m, MESSAGE_TYPES))] = (func, _wants_destination(func))
+            return func
+        return decorator
+
+    def default(self):
+        def decorator(func):
+            self._default = (func, _wants_destination(func))
+            return func
+        return decorator
+
+    def verify(self, body, signature):
+        mac = self._mac.copy()
+        mac.update(body)
+        digest = mac.digest()
+        if not hmac.compare_digest((signature or "").encode("utf-8"), base64.b64encode(digest)):
+            raise InvalidSignatureError("Invalid signature. signature=" + repr(signature))
+
+    def handle(self, body, signature):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.verify(body, signature)
+        self.dispatch(json.loads(body))
+
+    def dispatch(self, payload):
+        destination = payload.get("destination")
+        handlers = self._handlers
+        for raw in payload.get("events", ()):
+            etype = raw.get("type")
+            entry = None
+            if etype == "message":
+                entry = handlers.get((etype, raw.get("message", {}).get("type")))
+            if entry is None:
+                entry = handlers.get((etype, None)) or self._default
+            if entry is None:
+                LOGGER.info("No handler of %s and no default handler", etype)
+                continue
+            func, with_destination = entry
+            if with_destination:
+                func(EventView(raw), destination)
+            else:
+                func(EventView(raw))
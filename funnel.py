@@ -0,0 +1,170 @@
+"""問診ファネルの集計
+
+遷移のたびにステップ番号で引いた配列のカウンタを増やすだけなので、
+集計結果の取り出しはステップ数×日数に比例し、ユーザー数には依存しない。
+
+    entered   … そのステップの質問を出した回数
+    completed … 回答して次へ進んだ回数
+    failures  … 入力エラーで同じステップに留まった回数
+    seconds   … 質問を出してから回答までの時間（ヒストグラム）
+"""
+import bisect
+import collections
+import threading
+import time
+from datetime import datetime
+
+STEP_BUCKETS = (5, 10, 30, 60, 120, 300, 600, 1800, 3600, 6 * 3600, 24 * 3600)
+
+
+class _Day:
+    __slots__ = ("entered", "completed", "failures", "seconds_sum", "hist")
+
+    def __init__(self, n, nb):
+        self.entered     = [0] * n
+        self.completed   = [0] * n
+        self.failures    = [0] * n
+        self.seconds_sum = [0.0] * n
+        self.hist        = [[0] * (nb + 1) for _ in range(n)]  # 最後は +Inf
+
+
+class Funnel:
+    def __init__(self, steps, buckets=STEP_BUCKETS, keep_days=31, max_tracked=100000):
+        self.steps       = list(steps)
+        self.index       = {s: i for i, s in enumerate(self.steps)}
+        self.buckets     = tuple(buckets)
+        self.keep_days   = keep_days
+        self.max_tracked = max_tracked
+        self._days       = collections.OrderedDict()  # "YYYY-MM-DD" -> _Day
+        self._since      = {}  # user_id -> (ステップ番号, 質問を出した時刻)
+        self._today      = (0.0, 0.0, None)  # (その日の開始, 終了, _Day)
+        self._lock       = threading.Lock()
+
+    def _day(self, now):
+        # 同じ日のあいだは日付の計算を省く
+        start, end, day = self._today
+        if start <= now < end:
+            return day
+        dt    = datetime.fromtimestamp(now)
+        key   = dt.strftime("%Y-%m-%d")
+        start = datetime.combine(dt.date(), datetime.min.time()).timestamp()
+        day   = self._days.get(key)
+        if day is None:
+            day = self._days[key] = _Day(len(self.steps), len(self.buckets))
+            while len(self._days) > self.keep_days:
+                self._days.popitem(last=False)
+        self._today = (start, start + 24 * 3600, day)
+        return day
+
+    # ====== 記録 ======
+    def enter(self, user_id, step, now=None):
+        i = self.index.get(step)
+        if i is None:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            self._day(now).entered[i] += 1
+            self._since.pop(user_id, None)
+            self._since[user_id] = (i, now)
+            # 途中離脱のユーザーが溜まり続けないよう古い順に捨てる
+            while len(self._since) > self.max_tracked:
+                del self._since[next(iter(self._since))]
+
+    def complete(self, user_id, step, now=None):
+        i = self.index.get(step)
+        if i is None:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            day = self._day(now)
+            day.completed[i] += 1
+            since = self._since.pop(user_id, None)
+            if since is not None and since[0] == i:
+                seconds = now - since[1]
+                day.seconds_sum[i] += seconds
+                day.hist[i][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def fail(self, step, now=None):
+        i = self.index.get(step)
+        if i is None:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            self._day(now).failures[i] += 1
+
+    def transition(self, user_id, before, after, now=None):
+        """回答前後の「次の質問」から遷移を記録する（after=None は完了）"""
+        if before is None:
+            return
+        if before == after:
+            self.fail(before, now)
+            return
+        self.complete(user_id, before, now)
+        if after is not None:
+            self.enter(user_id, after, now)
+
+    def forget(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._since.clear()
+            else:
+                self._since.pop(user_id, None)
+
+    # ====== 集計 ======
+    def _percentile(self, hist, q):
+        total = sum(hist)
+        if not total:
+            return None
+        rank = q * total
+        acc  = 0
+        for le, n in zip(self.buckets + (float("inf"),), hist):
+            acc += n
+            if acc >= rank:
+                return le if le != float("inf") else None
+        return None
+
+    def _rows(self, entered, completed, failures, seconds_sum, hist):
+        rows = []
+        for i, step in enumerate(self.steps):
+            timed = sum(hist[i])
+            rows.append({
+                "step":       step,
+                "entered":    entered[i],
+                "completed":  completed[i],
+                "dropped":    max(entered[i] - completed[i], 0),
+                "failures":   failures[i],
+                "conversion": round(completed[i] / entered[i], 4) if entered[i] else None,
+                "seconds": {
+                    "mean": round(seconds_sum[i] / timed, 1) if timed else None,
+                    "p50":  self._percentile(hist[i], 0.5),
+                    "p90":  self._percentile(hist[i], 0.9),
+                    "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], hist[i])),
+                },
+            })
+        return rows
+
+    def report(self, days=7):
+        """直近 days 日の日別と合計"""
+        n  = len(self.steps)
+        nb = len(self.buckets) + 1
+        with self._lock:
+            picked = [(k, d.entered[:], d.completed[:], d.failures[:], d.seconds_sum[:], [h[:] for h in d.hist])
+                      for k, d in list(self._days.items())[-days:]]
+            tracked = len(self._since)
+        total = [[0] * n, [0] * n, [0] * n, [0.0] * n, [[0] * nb for _ in range(n)]]
+        daily = []
+        for key, entered, completed, failures, seconds_sum, hist in picked:
+            daily.append({"date": key, "steps": self._rows(entered, completed, failures, seconds_sum, hist)})
+            for i in range(n):
+                total[0][i] += entered[i]
+                total[1][i] += completed[i]
+                total[2][i] += failures[i]
+                total[3][i] += seconds_sum[i]
+                for b in range(nb):
+                    total[4][i][b] += hist[i][b]
+        return {
+            "days":          len(daily),
+            "tracked_users": tracked,
+            "total":         self._rows(*total),
+            "daily":         daily,
+        }
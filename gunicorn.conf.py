@@ -0,0 +1,55 @@
+"""gunicorn 設定（gunicorn app:app で自動的に読み込まれる）
+
+app.py を親プロセスで1回だけ import し（preload）、gc.freeze() してから fork する。
+import 済みのモジュール・定型メッセージは各ワーカーでコピーオンライトのまま共有される。
+ログ・ジャーナルの書き込みスレッド、ウォームアップ、LINE / SMTP の接続は
+post_fork で各ワーカーが自分で用意する。
+スケジューラはロックファイルを取った1ワーカーだけが動かす（フォローアップの二重送信を防ぐ）。
+終了時は worker_exit で app.shutdown() を呼び、処理中の Webhook と送信待ちを片付ける。
+
+回答途中・完了済み・通常チャットへ移行済みの状態はプロセスごとのメモリにあるので、
+1ワーカー＋スレッドで動かす（ワーカーを増やすと同じユーザーのイベントが別のワーカーへ
+届いて流れが壊れる）。状態を共有ストアへ移すまでは WEB_CONCURRENCY>1 では起動しない。
+"""
+import gc
+import os
+import tempfile
+
+os.environ["GUNICORN_PRELOAD"] = "1"
+os.environ.setdefault("SCHEDULER_LOCK", os.path.join(tempfile.gettempdir(), "my-line-bot-scheduler.lock"))
+
+bind                = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers             = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class        = "gthread"
+threads             = int(os.getenv("GUNICORN_THREADS", "8"))
+preload_app         = True
+timeout             = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout    = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "25"))
+keepalive           = 5
+max_requests        = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+accesslog           = "-"
+
+# import 中にできたオブジェクトを世代移動させない（fork 後にページが書き換わるのを防ぐ）
+gc.disable()
+
+
+def on_starting(server):
+    if workers > 1:
+        raise RuntimeError(f"ワーカーは1つでしか動かせません（WEB_CONCURRENCY={workers}）。GUNICORN_THREADS で増やしてください")
+
+
+def pre_fork(server, worker):
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+    import app
+    app.after_fork()
+
+
+def worker_exit(server, worker):
+    # SIGTERM 後: 処理中の Webhook・送信待ちのメール / push を片付けてから終わる
+    import app
+    app.shutdown()
@@ -0,0 +1,60 @@
+"""依存先の状態をバックグラウンドで定期的に確かめておく
+
+/ready のたびに LINE や SMTP へつなぎに行くと、ヘルスチェックの回数だけ外へ通信が出る。
+ここでは一定間隔でチェックを回して結果を覚えておき、/ready はその結果を返すだけにする。
+
+    prober = HealthProber(interval=15)
+    prober.add("smtp", check_smtp)       # check_smtp() は詳細の dict を返す（失敗は例外）
+    prober.start()
+    prober.snapshot()                    # {"smtp": {"ok": True, "age": 3.2, ...}}
+"""
+import threading
+import time
+
+
+class HealthProber:
+    def __init__(self, interval=15.0):
+        self.interval = interval
+        self._checks  = []
+        self._results = {}  # 名前 -> (ok, 詳細, 確認した時刻)
+        self._stop    = threading.Event()
+        self._thread  = None
+
+    def add(self, name, func):
+        self._checks.append((name, func))
+        self._results[name] = (False, {"error": "not checked yet"}, None)
+
+    def run_once(self):
+        for name, func in self._checks:
+            started = time.monotonic()
+            try:
+                ok, detail = True, dict(func() or {})
+            except Exception as e:
+                ok, detail = False, {"error": repr(e)}
+            detail["ms"] = round((time.monotonic() - started) * 1000, 1)
+            self._results[name] = (ok, detail, time.monotonic())  # dict の置き換えだけなので読み手はロック不要
+
+    def _loop(self):
+        while True:
+            self.run_once()
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="health", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def result(self, name):
+        return self._results[name]
+
+    def snapshot(self):
+        now = time.monotonic()
+        out = {}
+        for name, (ok, detail, checked_at) in list(self._results.items()):
+            out[name] = {"ok": ok, "age": None if checked_at is None else round(now - checked_at, 1), **detail}
+        return out
@@ -0,0 +1,187 @@
+"""管理画面用の二次索引（書き込み時に更新し、一覧はカーソルで区切って返す）
+
+    SortedIndex  … (キー, user_id) の昇順リスト。bisect で位置を探すので、
+                   何ページ目でも全件を舐めずに続きから返せる
+    GroupIndex   … グループ（質問ステップなど）ごとの SortedIndex
+    IndexedDict  … 値から求めたキーで SortedIndex を自動更新する dict（completed_users 用）
+
+カーソルは最後に返した (キー, user_id) を URL に載せられる文字列にしたもの。
+途中で追加・削除があっても、続きはそのキーより後ろから返す。
+"""
+import base64
+import bisect
+import json
+import threading
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(key, user_id):
+    raw = json.dumps([key, user_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key, user_id = json.loads(raw)
+        return (key, user_id)
+    except Exception:
+        raise InvalidCursor(cursor)
+
+
+class SortedIndex:
+    def __init__(self):
+        self._items = []  # [(キー, user_id)] 昇順
+        self._keys  = {}  # user_id -> キー
+        self._lock  = threading.Lock()
+
+    def add(self, user_id, key):
+        with self._lock:
+            old = self._keys.get(user_id)
+            if old == key:
+                return
+            if old is not None:
+                self._remove(old, user_id)
+            self._keys[user_id] = key
+            entry = (key, user_id)
+            if not self._items or self._items[-1] < entry:
+                self._items.append(entry)  # ほとんどは時刻順に増えるので末尾に足すだけ
+            else:
+                bisect.insort(self._items, entry)
+
+    def _remove(self, key, user_id):
+        i = bisect.bisect_left(self._items, (key, user_id))
+        if i < len(self._items) and self._items[i] == (key, user_id):
+            del self._items[i]
+
+    def discard(self, user_id):
+        with self._lock:
+            key = self._keys.pop(user_id, None)
+            if key is not None:
+                self._remove(key, user_id)
+
+    def key(self, user_id):
+        return self._keys.get(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._keys.clear()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def page(self, cursor=None, limit=50, lo=None, hi=None, reverse=False):
+        """[(キー, user_id)] と次のカーソル（最後まで返したら None）を返す。lo <= キー < hi で絞り込める"""
+        after = decode_cursor(cursor) if cursor else None
+        with self._lock:
+            items = self._items
+            start = 0 if lo is None else bisect.bisect_left(items, (lo,))
+            end   = len(items) if hi is None else bisect.bisect_left(items, (hi,))
+            if after is not None:
+                if reverse:
+                    end = min(end, bisect.bisect_left(items, after))
+                else:
+                    start = max(start, bisect.bisect_right(items, after))
+            if reverse:
+                rows = items[max(start, end - limit):end][::-1]
+                more = end - limit > start
+            else:
+                rows = items[start:min(end, start + limit)]
+                more = start + limit < end
+        next_cursor = encode_cursor(*rows[-1]) if rows and more else None
+        return rows, next_cursor
+
+
+class GroupIndex:
+    def __init__(self):
+        self._groups = {}  # グループ -> SortedIndex
+        self._member = {}  # user_id -> グループ
+        self._lock   = threading.Lock()
+
+    def set(self, user_id, group, key):
+        """user_id を group に入れる。同じグループのままならキー（並び順）は変えない"""
+        with self._lock:
+            old = self._member.get(user_id)
+            if old == group:
+                return
+            if old is not None:
+                self._groups[old].discard(user_id)
+            self._member[user_id] = group
+            index = self._groups.get(group)
+            if index is None:
+                index = self._groups[group] = SortedIndex()
+        index.add(user_id, key)
+
+    def discard(self, user_id):
+        with self._lock:
+            old = self._member.pop(user_id, None)
+        if old is not None:
+            self._groups[old].discard(user_id)
+
+    def group(self, user_id):
+        return self._member.get(user_id)
+
+    def key(self, user_id):
+        group = self._member.get(user_id)
+        return None if group is None else self._groups[group].key(user_id)
+
+    def counts(self):
+        return {group: len(index) for group, index in list(self._groups.items()) if len(index)}
+
+    def clear(self):
+        with self._lock:
+            self._groups.clear()
+            self._member.clear()
+
+    def page(self, group, cursor=None, limit=50):
+        index = self._groups.get(group)
+        if index is None:
+            if cursor:
+                decode_cursor(cursor)
+            return [], None
+        return index.page(cursor, limit)
+
+
+class IndexedDict(dict):
+    """書き込みのたびに key(value) の順の SortedIndex を更新する dict
+
+    ジャーナルの復元（clear / update / pop）も含め、書き込みはすべてここを通る。
+    """
+    def __init__(self, key):
+        super().__init__()
+        self.key   = key
+        self.index = SortedIndex()
+
+    def __setitem__(self, user_id, value):
+        super().__setitem__(user_id, value)
+        self.index.add(user_id, self.key(value))
+
+    def __delitem__(self, user_id):
+        super().__delitem__(user_id)
+        self.index.discard(user_id)
+
+    def pop(self, user_id, *default):
+        value = super().pop(user_id, *default)
+        self.index.discard(user_id)
+        return value
+
+    def setdefault(self, user_id, default=None):
+        if user_id not in self:
+            self[user_id] = default
+        return self[user_id]
+
+    def update(self, *args, **kwargs):
+        for user_id, value in dict(*args, **kwargs).items():
+            self[user_id] = value
+
+    def clear(self):
+        super().clear()
+        self.index.clear()
+
+    def __reduce__(self):
+        # スナップショットなどでは普通の dict として扱う
+        return (dict, (dict(self),))
@@ -0,0 +1,169 @@
+"""完了した問診の保存（SQLite）
+
+回答そのもの（dict）と、完了日時・フォローアップ送信日時・その時点の表示名を1行に保存する。
+サマリーの文字列は保存せず、必要なときに回答から作り直す。
+
+    status … pending（フォローアップ待ち） / followed_up（送信済み） / superseded（回答し直した）
+
+user_id・finished_at・status に索引を張り、一覧・書き出しは (finished_at, id) の位置から
+続きを読む（OFFSET を使わない）ので、何件目からでも同じ速さで読める。
+保存期間を過ぎた行は purge() で少しずつ消す（1回のトランザクションを短くするため）。
+
+接続はプロセスごとに1本をロックで順番に使う（書き込みは問診完了時とスケジューラだけなので十分）。
+SQLite の接続は fork をまたいで使えないので、プロセスが変わったら開き直す（gunicorn の preload 用）。
+path を省略するとメモリ上の DB になる（再起動で消える。fork 後は各プロセスの複製になる）。
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS intakes (
+    id               INTEGER PRIMARY KEY,
+    user_id          TEXT    NOT NULL,
+    finished_at      REAL    NOT NULL,
+    followup_sent_at REAL,
+    nickname         TEXT    NOT NULL DEFAULT '',
+    status           TEXT    NOT NULL DEFAULT 'pending',
+    answers          TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS intakes_user     ON intakes (user_id, finished_at);
+CREATE INDEX IF NOT EXISTS intakes_finished ON intakes (finished_at, id);
+CREATE INDEX IF NOT EXISTS intakes_status   ON intakes (status, finished_at);
+"""
+
+# 統計がないと user_id の条件でも intakes_status を選んでフォローアップ待ち全件を舐めるので、
+# status の索引を使わせない（+status）
+SUPERSEDE = "UPDATE intakes SET status = 'superseded' WHERE user_id = ? AND +status = 'pending'"
+
+
+class Intake(dict):
+    """1件分（行の列名でアクセスする dict。finished_at などは datetime に直してある）"""
+
+
+class IntakeStore:
+    def __init__(self, path=None):
+        self.path       = path or ":memory:"
+        self.persistent = bool(path)
+        self._inherited = []  # fork 前の接続（子プロセスで閉じると親のロックを壊すので閉じずに持っておく）
+        self._connect()
+
+    def _connect(self):
+        self._pid  = os.getpid()
+        self._lock = threading.Lock()
+        self._db   = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        if self.persistent:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def reopen(self):
+        """fork した子プロセスで親の接続を使わないよう開き直す（メモリ上の DB はそのまま使う）"""
+        if self.persistent and self._pid != os.getpid():
+            self._inherited.append(self._db)
+            self._connect()
+
+    def _conn(self):
+        if self._pid != os.getpid():
+            self.reopen()
+        return self._db
+
+    def _execute(self, sql, params=(), fetch=None):
+        db = self._conn()
+        with self._lock:
+            cur = db.execute(sql, params)
+            if fetch == "one":
+                return cur.fetchone()
+            if fetch == "all":
+                return cur.fetchall()
+            return cur
+
+    @staticmethod
+    def _row(row):
+        item = Intake(row)
+        item["answers"]     = json.loads(row["answers"])
+        item["finished_at"] = datetime.fromtimestamp(row["finished_at"])
+        if row["followup_sent_at"] is not None:
+            item["followup_sent_at"] = datetime.fromtimestamp(row["followup_sent_at"])
+        return item
+
+    # ====== 書き込み ======
+    def add(self, user_id, finished_at, nickname, answers):
+        """完了した問診を保存して id を返す。同じユーザーのフォローアップ待ちは superseded にする"""
+        data = json.dumps(answers, ensure_ascii=False, default=str)
+        db   = self._conn()
+        with self._lock, db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(SUPERSEDE, (user_id,))
+            cur = db.execute(
+                "INSERT INTO intakes (user_id, finished_at, nickname, answers) VALUES (?, ?, ?, ?)",
+                (user_id, finished_at.timestamp(), nickname, data),
+            )
+        return cur.lastrowid
+
+    def supersede(self, user_id):
+        """問診をやり直し始めたユーザーのフォローアップ待ちを superseded にする"""
+        self._execute(SUPERSEDE, (user_id,))
+
+    def mark_followed_up(self, user_id, when):
+        self._execute(
+            "UPDATE intakes SET status = 'followed_up', followup_sent_at = ? WHERE user_id = ? AND status = 'pending'",
+            (when.timestamp(), user_id),
+        )
+
+    def purge(self, before, batch=500):
+        """finished_at が before より前の行を batch 件まで消す。消した件数を返す"""
+        return self._execute(
+            "DELETE FROM intakes WHERE id IN (SELECT id FROM intakes WHERE finished_at < ? ORDER BY finished_at LIMIT ?)",
+            (before.timestamp(), batch),
+        ).rowcount
+
+    def clear(self):
+        self._execute("DELETE FROM intakes")
+
+    # ====== 読み取り ======
+    def get(self, intake_id):
+        row = self._execute("SELECT * FROM intakes WHERE id = ?", (intake_id,), "one")
+        return None if row is None else self._row(row)
+
+    def for_user(self, user_id, limit=20):
+        rows = self._execute(
+            "SELECT * FROM intakes WHERE user_id = ? ORDER BY finished_at DESC LIMIT ?", (user_id, limit), "all")
+        return [self._row(r) for r in rows]
+
+    def pending_followups(self, before):
+        """finished_at が before 以前でフォローアップ未送信のユーザー（古い順）"""
+        rows = self._execute(
+            "SELECT user_id, MIN(finished_at) AS first FROM intakes"
+            " WHERE status = 'pending' AND followup_sent_at IS NULL AND finished_at <= ?"
+            " GROUP BY user_id ORDER BY first",
+            (before.timestamp(),), "all")
+        return [r["user_id"] for r in rows]
+
+    def count(self, status=None):
+        if status is None:
+            return self._execute("SELECT COUNT(*) FROM intakes", (), "one")[0]
+        return self._execute("SELECT COUNT(*) FROM intakes WHERE status = ?", (status,), "one")[0]
+
+    def iter_range(self, since=None, until=None, batch=500):
+        """finished_at が since 以上 until 未満の行を古い順に返す（batch 件ずつ読む）"""
+        lo = (since.timestamp() if since else float("-inf"), 0)
+        hi = until.timestamp() if until else float("inf")
+        while True:
+            rows = self._execute(
+                "SELECT * FROM intakes WHERE (finished_at, id) > (?, ?) AND finished_at < ?"
+                " ORDER BY finished_at, id LIMIT ?",
+                (lo[0], lo[1], hi, batch), "all")
+            for row in rows:
+                yield self._row(row)
+            if len(rows) < batch:
+                return
+            lo = (rows[-1]["finished_at"], rows[-1]["id"])
+
+    def close(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                self._db.close()
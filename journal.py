@@ -0,0 +1,236 @@
+"""状態ジャーナル（追記専用ログ + スナップショット圧縮）
+
+状態遷移はすべて append() でキューに積み、書き込みスレッドがまとめて
+ファイルへ書き出す（グループコミット）。定期的に compact() でスナップショット
+を取り、古いジャーナルを削除する。起動時は recover() で
+スナップショット + ジャーナル末尾を再生してメモリ上の構造へ戻す。
+
+ジャーナルとスナップショットは1プロセスだけが書く前提なので、start() で
+ディレクトリのロックファイルを排他ロックし、取れなければ JournalLocked で止める。
+"""
+import fcntl
+import glob
+import json
+import os
+import pickle
+import queue
+import threading
+from datetime import datetime
+
+SNAPSHOT_NAME = "snapshot.pkl"
+JOURNAL_FMT   = "journal-{:08d}.log"
+LOCK_NAME     = "journal.lock"
+
+_STOP = object()
+
+
+class JournalLocked(RuntimeError):
+    pass
+
+
+# ====== 操作の適用 ======
+# op は JSON 配列: [種別, user_id, ...]
+#   set     : 回答の差分をマージ      ["set", uid, {key: val}]
+#   new     : 回答を空で開始          ["new", uid]
+#   drop    : 回答を破棄              ["drop", uid]
+#   done    : 完了（フォローアップ待ち） ["done", uid, 完了時刻(epoch), サマリー]
+#   undone  : 完了状態を解除          ["undone", uid]
+#   greet   : 案内済み                ["greet", uid]
+#   release : 通常チャットへ移行      ["release", uid]
+#   reset   : すべて初期化            ["reset"]
+def apply_op(structs, op):
+    kind = op[0]
+    if kind == "set":
+        structs["user_states"].setdefault(op[1], {}).update(op[2])
+    elif kind == "new":
+        structs["user_states"][op[1]] = {}
+    elif kind == "drop":
+        structs["user_states"].pop(op[1], None)
+    elif kind == "done":
+        structs["completed_users"][op[1]] = (datetime.fromtimestamp(op[2]), op[3])
+    elif kind == "undone":
+        structs["completed_users"].pop(op[1], None)
+    elif kind == "greet":
+        structs["greeted_users"].add(op[1])
+    elif kind == "release":
+        structs["released_users"].add(op[1])
+    elif kind == "reset":
+        for s in structs.values():
+            s.clear()
+
+
+class StateJournal:
+    def __init__(self, directory, structs, fsync=True, batch_size=512):
+        self.directory  = directory
+        self.structs    = structs  # name -> dict/set（app.py のモジュール変数そのもの）
+        self.fsync      = fsync
+        self.batch_size = batch_size
+
+        self._queue   = queue.SimpleQueue()
+        self._lock    = threading.Lock()  # 世代切り替えと append の排他
+        self._gen     = 0
+        self._file    = None
+        self._thread  = None
+        self._lock_fd = None
+        self.appended = 0  # 前回スナップショット以降の件数
+
+        os.makedirs(directory, exist_ok=True)
+
+    # ====== 起動時の復元 ======
+    def recover(self):
+        """ファイルから作り直す。何度呼んでもよい（fork 後のワーカーでも呼び直す）"""
+        for target in self.structs.values():
+            target.clear()
+        self._gen = 0
+        snap_gen  = 0
+        path = os.path.join(self.directory, SNAPSHOT_NAME)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                snap = pickle.load(f)
+            snap_gen = snap["gen"]
+            for name, data in snap["structs"].items():
+                target = self.structs[name]
+                target.clear()
+                target.update(data)
+
+        replayed = 0
+        for gen, log_path in self._journal_files():
+            if gen < snap_gen:
+                continue
+            with open(log_path, "rb") as f:
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        break  # 書き込み途中で落ちた末尾行は捨てる
+                    apply_op(self.structs, op)
+                    replayed += 1
+            self._gen = max(self._gen, gen)
+
+        self._gen = max(self._gen, snap_gen) + 1
+        self.appended = replayed
+        return replayed
+
+    def _journal_files(self):
+        files = []
+        for p in glob.glob(os.path.join(self.directory, "journal-*.log")):
+            try:
+                files.append((int(os.path.basename(p)[8:16]), p))
+            except ValueError:
+                continue
+        return sorted(files)
+
+    # ====== 書き込み ======
+    def _acquire(self):
+        # fork で引き継いだ fd はロックを共有してしまうので、開くところからこのプロセスで行う
+        path = os.path.join(self.directory, LOCK_NAME)
+        fd   = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            with open(path) as f:
+                holder = f.read().strip()
+            os.close(fd)
+            raise JournalLocked(f"{self.directory} は別のプロセス（pid {holder or '?'}）が使用中です")
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        self._lock_fd = fd
+
+    def _release(self):
+        os.close(self._lock_fd)  # ロックも外れる
+        self._lock_fd = None
+
+    def start(self):
+        self._acquire()
+        self._file = open(self._journal_path(self._gen), "ab")
+        self._thread = threading.Thread(target=self._writer, name="state-journal", daemon=True)
+        self._thread.start()
+
+    def _journal_path(self, gen):
+        return os.path.join(self.directory, JOURNAL_FMT.format(gen))
+
+    def append(self, *op):
+        # ホットパスはキューに積むだけ（エンコードは書き込みスレッド側）
+        self._queue.put(op)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _writer(self):
+        q = self._queue
+        while True:
+            ops = [q.get()]
+            while len(ops) < self.batch_size:
+                try:
+                    ops.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in ops
+            lines = [json.dumps(op, ensure_ascii=False, separators=(",", ":")) for op in ops if op is not _STOP]
+            if lines:
+                self._write(("\n".join(lines) + "\n").encode("utf-8"), len(lines))
+            if stop:
+                return
+
+    def _write(self, data, count):
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.appended += count
+
+    # ====== スナップショット圧縮 ======
+    def compact(self):
+        # start() していなければ（オフラインの圧縮など）この間だけロックを取る
+        held = self._lock_fd is not None
+        if not held:
+            self._acquire()
+        try:
+            self._compact()
+        finally:
+            if not held:
+                self._release()
+
+    def _compact(self):
+        with self._lock:
+            # ここまでに書かれた op はすべてスナップショットに含まれる。
+            # 以降の op は新しい世代へ（再生は冪等なので重複してもよい）
+            structs = {
+                "user_states":     {uid: dict(s) for uid, s in list(self.structs["user_states"].items())},
+                "completed_users": dict(self.structs["completed_users"]),
+                "greeted_users":   set(self.structs["greeted_users"]),
+                "released_users":  set(self.structs["released_users"]),
+            }
+            self._gen += 1
+            new_gen = self._gen
+            if self._file is not None:
+                self._file.close()
+                self._file = open(self._journal_path(new_gen), "ab")
+            self.appended = 0
+
+        tmp = os.path.join(self.directory, SNAPSHOT_NAME + ".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump({"gen": new_gen, "structs": structs}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.directory, SNAPSHOT_NAME))
+
+        for gen, path in self._journal_files():
+            if gen < new_gen:
+                os.remove(path)
+
+    def maybe_compact(self, threshold=10000):
+        if self.appended >= threshold:
+            self.compact()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        with self._lock:
+            self._file.close()
+            self._file = None
+        self._release()
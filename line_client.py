@@ -0,0 +1,91 @@
+"""LINE Messaging API 用 HTTP クライアント
+
+SDK の RequestsHttpClient に、エンドポイント別の所要時間とステータスの計測を足したもの。
+SDK は呼び出しごとに requests.post() で接続し直すので、Session で接続を使い回す。
+LineBotApi(..., http_client=InstrumentedHttpClient) で使う。
+"""
+import re
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from linebot.http_client import HttpClient, RequestsHttpClient, RequestsHttpResponse
+
+from metrics import registry
+
+LINE_API_SECONDS = registry.histogram(
+    "line_api_request_seconds", "LINE Messaging API の呼び出し時間", ["method", "endpoint"])
+LINE_API_RESPONSES = registry.counter(
+    "line_api_responses_total", "LINE Messaging API の応答数（status=error は通信エラー）", ["method", "endpoint", "status"])
+
+_ID_SEGMENT = re.compile(r"/(?:[UCR][0-9a-f]{32}|\d+)(?=/|$)")
+
+
+def endpoint_label(url):
+    # ユーザーID・メッセージIDはラベルに入れない
+    return _ID_SEGMENT.sub("/{id}", urlsplit(url).path)
+
+
+class InstrumentedHttpClient(RequestsHttpClient):
+    def __init__(self, timeout=HttpClient.DEFAULT_TIMEOUT, pool_maxsize=10):
+        super().__init__(timeout)
+        self.pool_maxsize = pool_maxsize
+        self.session      = self._new_session()
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def reset(self):
+        """接続を捨てて作り直す（fork 後など）"""
+        old, self.session = self.session, self._new_session()
+        old.close()
+
+    def pool_stats(self):
+        """接続プールの状態（ホスト数と、待機中でつながっている接続の本数）"""
+        pools = list(self.session.get_adapter("https://").poolmanager.pools._container.values())
+        idle  = sum(1 for pool in pools for conn in list(pool.pool.queue) if conn is not None)
+        return {"hosts": len(pools), "idle": idle, "maxsize": self.pool_maxsize}
+
+    def _observe(self, method, url, call):
+        endpoint = endpoint_label(url)
+        start    = time.perf_counter()
+        status   = "error"
+        try:
+            response = call()
+            status   = str(response.status_code)
+            return RequestsHttpResponse(response)
+        finally:
+            LINE_API_SECONDS.observe(time.perf_counter() - start, method=method, endpoint=endpoint)
+            LINE_API_RESPONSES.inc(method=method, endpoint=endpoint, status=status)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._observe("GET", url, lambda: self.session.get(
+            url, headers=headers, params=params, stream=stream, timeout=timeout or self.timeout))
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._observe("POST", url, lambda: self.session.post(
+            url, headers=headers, data=data, timeout=timeout or self.timeout))
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._observe("DELETE", url, lambda: self.session.delete(
+            url, headers=headers, data=data, timeout=timeout or self.timeout))
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._observe("PUT", url, lambda: self.session.put(
+            url, headers=headers, data=data, timeout=timeout or self.timeout))
+
+
+class PrebuiltMessage:
+    """as_json_dict() を組み立て済みで返す送信メッセージ（定型の返信用）"""
+    __slots__ = ("_json",)
+
+    def __init__(self, message):
+        self._json = message.as_json_dict()
+
+    def as_json_dict(self):
+        return self._json
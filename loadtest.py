@@ -0,0 +1,235 @@
+"""Webhook 負荷試験
+
+N 人の LINE ユーザーが 友だち追加 → 都道府県 … アレルギー まで問診を進める
+Webhook を、チャネルシークレットで署名して /callback へ同時に送る。
+ステップごとの p50 / p95 / p99 と、1分あたりの問診完了数を出す。
+
+    # LINE / SMTP の代替サーバーとアプリを起動して計測
+    python loadtest.py --users 500 --concurrency 32 --spawn
+
+    # 起動済みのアプリに対して計測
+    python loadtest.py --url http://127.0.0.1:5000/callback --secret $LINE_CHANNEL_SECRET
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# ====== 問診フロー（ステップ名, 種別, 値） ======
+FLOW = [
+    ("follow",      "follow",   None),
+    ("都道府県",    "text",     "東京都"),
+    ("お名前",      "text",     "山田 花子"),
+    ("フリガナ",    "text",     "ヤマダ ハナコ"),
+    ("電話番号",    "text",     "09012345678"),
+    ("生年月日_年", "text",     "1990"),
+    ("生年月日_月", "text",     "4"),
+    ("生年月日_日", "text",     "15"),
+    ("性別",        "postback", "gender_female"),
+    ("身長",        "text",     "160"),
+    ("体重",        "text",     "50"),
+    ("アルコール",  "postback", "alcohol_no"),
+    ("副腎皮質ホルモン剤", "postback", "steroid_no"),
+    ("がん",        "postback", "cancer_no"),
+    ("糖尿病",      "postback", "diabetes_no"),
+    ("その他病気",  "postback", "other_yes"),
+    ("病名",        "text",     "高血圧"),
+    ("お薬服用",    "postback", "med_yes"),
+    ("服用薬",      "text",     "アムロジピン"),
+    ("アレルギー",  "postback", "allergy_yes"),
+    ("アレルギー名", "text",    "花粉"),
+]
+
+
+def make_event(kind, user_id, value):
+    event = {
+        "type":            kind if kind != "text" else "message",
+        "mode":            "active",
+        "timestamp":       int(time.time() * 1000),
+        "webhookEventId":  uuid.uuid4().hex.upper(),
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken":      f"rt-{int(time.time() * 1000)}-{uuid.uuid4().hex[:16]}",
+        "source":          {"type": "user", "userId": user_id},
+    }
+    if kind == "text":
+        event["message"] = {"id": str(random.getrandbits(60)), "type": "text", "quoteToken": "q", "text": value}
+    elif kind == "postback":
+        event["postback"] = {"data": value}
+    elif kind == "follow":
+        event["follow"] = {"isUnblocked": False}
+    return event
+
+
+def sign(secret, body):
+    return base64.b64encode(hmac.new(secret.encode("utf-8"), body, hashlib.sha256).digest()).decode("ascii")
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+class LoadTest:
+    def __init__(self, url, secret, users, concurrency, think_ms=0.0):
+        self.url         = url
+        self.secret      = secret
+        self.users       = users
+        self.concurrency = concurrency
+        self.think_ms    = think_ms
+        self.lock        = threading.Lock()
+        self.latencies   = {name: [] for name, _, _ in FLOW}
+        self.errors      = {name: 0 for name, _, _ in FLOW}
+        self.completed   = 0
+        self.local       = threading.local()
+
+    def session(self):
+        s = getattr(self.local, "session", None)
+        if s is None:
+            s = self.local.session = requests.Session()
+        return s
+
+    def post(self, event):
+        body = json.dumps({"destination": "Ubot", "events": [event]}, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json", "X-Line-Signature": sign(self.secret, body)}
+        started = time.perf_counter()
+        r = self.session().post(self.url, data=body, headers=headers, timeout=30)
+        return r.status_code, (time.perf_counter() - started) * 1000.0
+
+    def walk(self, n):
+        user_id = "U" + hashlib.md5(f"loadtest-{n}-{time.time()}".encode()).hexdigest()
+        ok = True
+        for name, kind, value in FLOW:
+            try:
+                status, ms = self.post(make_event(kind, user_id, value))
+            except requests.RequestException:
+                status, ms = 0, 0.0
+            with self.lock:
+                if status == 200:
+                    self.latencies[name].append(ms)
+                else:
+                    self.errors[name] += 1
+                    ok = False
+            if self.think_ms:
+                time.sleep(random.expovariate(1.0 / self.think_ms) / 1000.0)
+        if ok:
+            with self.lock:
+                self.completed += 1
+
+    def run(self):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            list(pool.map(self.walk, range(self.users)))
+        return time.perf_counter() - started
+
+    def report(self, elapsed):
+        requests_done = sum(len(v) for v in self.latencies.values())
+        steps = []
+        for name, _, _ in FLOW:
+            v = sorted(self.latencies[name])
+            steps.append({
+                "step":   name,
+                "count":  len(v),
+                "errors": self.errors[name],
+                "p50_ms": round(percentile(v, 50), 2),
+                "p95_ms": round(percentile(v, 95), 2),
+                "p99_ms": round(percentile(v, 99), 2),
+            })
+        return {
+            "users":              self.users,
+            "concurrency":        self.concurrency,
+            "elapsed_s":          round(elapsed, 3),
+            "requests_per_s":     round(requests_done / elapsed, 1),
+            "intakes_per_minute": round(self.completed / elapsed * 60.0, 1),
+            "completed":          self.completed,
+            "steps":              steps,
+        }
+
+
+def print_report(rep):
+    print(f"users={rep['users']} concurrency={rep['concurrency']} elapsed={rep['elapsed_s']}s")
+    print(f"throughput={rep['requests_per_s']} req/s  intakes={rep['intakes_per_minute']} /min  completed={rep['completed']}")
+    print(f"{'step':<20}{'count':>7}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for s in rep["steps"]:
+        print(f"{s['step']:<20}{s['count']:>7}{s['errors']:>5}{s['p50_ms']:>9.1f}{s['p95_ms']:>9.1f}{s['p99_ms']:>9.1f}")
+
+
+# ====== 代替サーバーとアプリの起動 ======
+def spawn_stack(args):
+    from werkzeug.serving import make_server
+    import mock_line_api
+    import mock_smtp
+
+    line = make_server("127.0.0.1", args.line_port,
+                       mock_line_api.create_app(mock_line_api.MockConfig({"default": args.line_latency})),
+                       threaded=True)
+    threading.Thread(target=line.serve_forever, name="mock-line", daemon=True).start()
+    mock_smtp.start_in_thread(port=args.smtp_port)
+
+    env = dict(os.environ)
+    env.update({
+        "LINE_API_ENDPOINT":         f"http://127.0.0.1:{args.line_port}",
+        "LINE_CHANNEL_SECRET":       args.secret,
+        "LINE_CHANNEL_ACCESS_TOKEN": env.get("LINE_CHANNEL_ACCESS_TOKEN") or "loadtest",
+        "SMTP_HOST":                 "127.0.0.1",
+        "SMTP_PORT":                 str(args.smtp_port),
+    })
+    app = subprocess.Popen(args.app_cmd.split(), env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    ping = args.url.rsplit("/", 1)[0] + "/ping"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if requests.get(ping, timeout=1).status_code == 200:
+                return app
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    app.terminate()
+    raise SystemExit("app did not become ready: " + ping)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="LINE webhook load test")
+    ap.add_argument("--url", default="http://127.0.0.1:5000/callback")
+    ap.add_argument("--secret", default=os.getenv("LINE_CHANNEL_SECRET", "loadtest-secret"))
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--think-ms", type=float, default=0.0, help="イベント間の平均待ち時間（指数分布）")
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    ap.add_argument("--spawn", action="store_true", help="LINE / SMTP の代替サーバーとアプリを起動する")
+    ap.add_argument("--app-cmd", default=f"{sys.executable} app.py")
+    ap.add_argument("--line-port", type=int, default=8081)
+    ap.add_argument("--line-latency", default="lognormal:3.4:0.3", help="mock_line_api の遅延分布（ms）")
+    ap.add_argument("--smtp-port", type=int, default=2525)
+    args = ap.parse_args()
+
+    app = spawn_stack(args) if args.spawn else None
+    try:
+        test = LoadTest(args.url, args.secret, args.users, args.concurrency, args.think_ms)
+        rep  = test.report(test.run())
+    finally:
+        if app is not None:
+            app.terminate()
+            app.wait(timeout=30)
+
+    if args.json:
+        print(json.dumps(rep, ensure_ascii=False, indent=2))
+    else:
+        print_report(rep)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""メモリ増加の調査（tracemalloc のスナップショット差分と構造体サイズ）"""
+import collections
+import itertools
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+MAX_SNAPSHOTS = 8
+
+_lock      = threading.Lock()
+_snapshots = collections.OrderedDict()  # id -> (作成時刻, Snapshot)
+_ids       = itertools.count(1)
+
+
+class UnknownSnapshot(Exception):
+    pass
+
+
+def start(frames=10):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    return status()
+
+
+def stop():
+    tracemalloc.stop()
+    with _lock:
+        _snapshots.clear()
+    return status()
+
+
+def status():
+    current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    with _lock:
+        snaps = [{"id": i, "taken_at": t} for i, (t, _) in _snapshots.items()]
+    return {
+        "tracing":       tracemalloc.is_tracing(),
+        "frames":        tracemalloc.get_traceback_limit(),
+        "traced_bytes":  current,
+        "peak_bytes":    peak,
+        "snapshots":     snaps,
+    }
+
+
+def take_snapshot():
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not tracing")
+    snap = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    with _lock:
+        sid = next(_ids)
+        _snapshots[sid] = (time.time(), snap)
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+    return sid
+
+
+def _get(sid):
+    with _lock:
+        if sid not in _snapshots:
+            raise UnknownSnapshot(sid)
+        return _snapshots[sid][1]
+
+
+def _site(stat):
+    frame = stat.traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+def top(sid, limit=20, group_by="lineno"):
+    stats = _get(sid).statistics(group_by)
+    return [{"site": _site(s), "size_bytes": s.size, "count": s.count} for s in stats[:limit]]
+
+
+def diff(old_id, new_id, limit=20, group_by="lineno"):
+    stats = _get(new_id).compare_to(_get(old_id), group_by)
+    return [
+        {"site": _site(s), "size_diff_bytes": s.size_diff, "size_bytes": s.size,
+         "count_diff": s.count_diff, "count": s.count}
+        for s in stats[:limit]
+    ]
+
+
+# ====== 構造体サイズ ======
+def deep_sizeof(obj):
+    """コンテナをたどった合計バイト数（共有オブジェクトは1回だけ数える）"""
+    seen  = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif hasattr(o, "__dict__") and not isinstance(o, (type, types.ModuleType, types.FunctionType)):
+            stack.append(vars(o))  # SessionStore など
+    return total
+
+
+def structure_sizes(structs):
+    out = {}
+    for name, obj in structs.items():
+        out[name] = {"entries": len(obj), "deep_bytes": deep_sizeof(obj)}
+    return out
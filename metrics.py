@@ -0,0 +1,192 @@
+"""Prometheus テキスト形式のメトリクス（依存ライブラリなし）
+
+    REQUESTS = registry.counter("x_total", "説明", ["endpoint"])
+    REQUESTS.inc(endpoint="reply")
+
+    with LATENCY.time(stage="verify"):
+        ...
+
+    @LATENCY.timed(stage="dispatch")
+    def f(): ...
+"""
+import bisect
+import threading
+import time
+from functools import wraps
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{v}"' for n, v in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(v):
+    if v == float("inf"):
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name   = name
+        self.help   = help_text
+        self.labels = tuple(labels)
+        self._lock  = threading.Lock()
+
+    def _key(self, kw):
+        return tuple(kw.get(n, "") for n in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def _items(self):
+        if self._func is not None:
+            try:
+                return [((), self._func())]
+            except Exception:
+                return []
+        with self._lock:
+            return sorted(self._values.items())
+
+
+class Counter(_Metric):
+    """inc() で増やすか、func で参照時に累計値を取る（他のオブジェクトが数えている累計用）"""
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=(), func=None):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+        self._func   = func
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        return self.header() + [f"{self.name}{_labels(self.labels, k)} {_num(v)}" for k, v in self._items()]
+
+
+class Gauge(_Metric):
+    """set() で値を持つか、func で参照時に値を取る"""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), func=None):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+        self._func   = func
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        return self.header() + [f"{self.name}{_labels(self.labels, k)} {_num(v)}" for k, v in self._items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i   = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def timed(self, **labels):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with _Timer(self, labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, **labels):
+        s = self._series.get(self._key(labels))
+        return 0 if s is None else s[-1]
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        out = self.header()
+        for key, s in items:
+            acc = 0
+            for le, n in zip(self.buckets, s):
+                acc += n
+                out.append(f"{self.name}_bucket{_labels(self.labels, key, [('le', _num(float(le)))])} {acc}")
+            out.append(f"{self.name}_bucket{_labels(self.labels, key, [('le', '+Inf')])} {s[-1]}")
+            out.append(f"{self.name}_sum{_labels(self.labels, key)} {_num(s[-2])}")
+            out.append(f"{self.name}_count{_labels(self.labels, key)} {s[-1]}")
+        return out
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "start")
+
+    def __init__(self, hist, labels):
+        self.hist   = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=(), func=None):
+        return self.register(Counter(name, help_text, labels, func))
+
+    def gauge(self, name, help_text, labels=(), func=None):
+        return self.register(Gauge(name, help_text, labels, func))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
@@ -0,0 +1,225 @@
+"""LINE Messaging API のローカル代替サーバー（負荷試験・オフライン検証用）
+
+reply / push / multicast / profile / bot info を実装し、すべての呼び出しを記録する。
+遅延の分布、429 / 5xx の注入、リプライトークンの使い回し・期限切れを再現できる。
+
+    python mock_line_api.py --port 8081 --latency default=lognormal:3.5:0.4 --rate-429 0.01
+    LINE_API_ENDPOINT=http://127.0.0.1:8081 python app.py
+
+記録の確認・設定変更:
+    GET    /__mock/calls?endpoint=reply   記録の一覧
+    DELETE /__mock/calls                  記録のクリア
+    GET    /__mock/stats                  エンドポイント別の件数・ステータス
+    POST   /__mock/config                 {"latency": {...}, "rate_429": 0.1, ...}
+"""
+import argparse
+import random
+import re
+import threading
+import time
+
+from flask import Flask, jsonify, request
+
+REPLY_TOKEN_RE = re.compile(r"^rt-(\d+)-")  # 負荷生成側のトークン形式 rt-<発行ms>-<乱数>
+
+
+# ====== 遅延の分布 ======
+def parse_latency(spec):
+    """"fixed:50" / "uniform:10:100" / "normal:50:10" / "lognormal:3.9:0.5" / "exp:50"（ms）"""
+    name, *params = spec.split(":")
+    p = [float(x) for x in params]
+    if name in ("0", "none"):
+        return lambda: 0.0
+    if name == "fixed":
+        return lambda: p[0]
+    if name == "uniform":
+        return lambda: random.uniform(p[0], p[1])
+    if name == "normal":
+        return lambda: max(0.0, random.gauss(p[0], p[1]))
+    if name == "lognormal":
+        return lambda: random.lognormvariate(p[0], p[1])
+    if name == "exp":
+        return lambda: random.expovariate(1.0 / p[0])
+    raise ValueError(f"unknown latency distribution: {spec}")
+
+
+class MockConfig:
+    def __init__(self, latency=None, rate_429=0.0, rate_5xx=0.0, reply_token_ttl=60.0, display_name="テストユーザー"):
+        self.latency_specs   = {"default": "0"}
+        self.latency         = {}
+        self.rate_429        = rate_429
+        self.rate_5xx        = rate_5xx
+        self.reply_token_ttl = reply_token_ttl
+        self.display_name    = display_name
+        self.set_latency(latency or {})
+
+    def set_latency(self, specs):
+        self.latency_specs.update(specs)
+        self.latency = {k: parse_latency(v) for k, v in self.latency_specs.items()}
+
+    def delay_ms(self, endpoint):
+        return (self.latency.get(endpoint) or self.latency["default"])()
+
+    def as_dict(self):
+        return {
+            "latency":         self.latency_specs,
+            "rate_429":        self.rate_429,
+            "rate_5xx":        self.rate_5xx,
+            "reply_token_ttl": self.reply_token_ttl,
+            "display_name":    self.display_name,
+        }
+
+
+# ====== サーバー ======
+def create_app(config=None):
+    app    = Flask(__name__)
+    config = config or MockConfig()
+    lock   = threading.Lock()
+    calls  = []
+    used_tokens = set()
+
+    app.config["MOCK"]  = config
+    app.config["CALLS"] = calls
+
+    def handle(endpoint, respond):
+        started = time.time()
+        body    = request.get_json(silent=True)
+        status, payload = _dispatch(endpoint, body, respond)
+        delay = config.delay_ms(endpoint)
+        if delay:
+            time.sleep(delay / 1000.0)
+        with lock:
+            calls.append({
+                "ts":         started,
+                "endpoint":   endpoint,
+                "path":       request.path,
+                "status":     status,
+                "latency_ms": round(delay, 3),
+                "body":       body,
+            })
+        return jsonify(payload), status
+
+    def _dispatch(endpoint, body, respond):
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return 401, {"message": "Authentication failed. Confirm that the access token in the authorization header is valid."}
+        r = random.random()
+        if r < config.rate_429:
+            return 429, {"message": "The API rate limit has been exceeded. Try again later."}
+        if r < config.rate_429 + config.rate_5xx:
+            return random.choice((500, 502, 503)), {"message": "Internal server error"}
+        return respond(body or {})
+
+    def reply(body):
+        token = body.get("replyToken", "")
+        if not token or not body.get("messages"):
+            return 400, {"message": "The request body has 1 error(s)"}
+        if len(body["messages"]) > 5:
+            return 400, {"message": "Size must be between 1 and 5"}
+        m = REPLY_TOKEN_RE.match(token)
+        with lock:
+            reused = token in used_tokens
+            used_tokens.add(token)
+        if reused or (m and time.time() - int(m.group(1)) / 1000.0 > config.reply_token_ttl):
+            return 400, {"message": "Invalid reply token"}
+        return 200, {}
+
+    def push(body):
+        if not body.get("to") or not body.get("messages"):
+            return 400, {"message": "The request body has 1 error(s)"}
+        return 200, {}
+
+    def multicast(body):
+        to = body.get("to") or []
+        if not to or len(to) > 500 or not body.get("messages"):
+            return 400, {"message": "The request body has 1 error(s)"}
+        return 200, {}
+
+    @app.route("/v2/bot/message/reply", methods=["POST"])
+    def api_reply():
+        return handle("reply", reply)
+
+    @app.route("/v2/bot/message/push", methods=["POST"])
+    def api_push():
+        return handle("push", push)
+
+    @app.route("/v2/bot/message/multicast", methods=["POST"])
+    def api_multicast():
+        return handle("multicast", multicast)
+
+    @app.route("/v2/bot/profile/<user_id>", methods=["GET"])
+    def api_profile(user_id):
+        return handle("profile", lambda body: (200, {
+            "userId":      user_id,
+            "displayName": config.display_name,
+            "pictureUrl":  "https://example.invalid/profile.png",
+            "language":    "ja",
+        }))
+
+    @app.route("/v2/bot/info", methods=["GET"])
+    def api_info():
+        return handle("info", lambda body: (200, {
+            "userId":      "Ubot",
+            "basicId":     "@mock",
+            "displayName": "mock bot",
+            "chatMode":    "bot",
+        }))
+
+    # ====== 記録・設定 ======
+    @app.route("/__mock/calls", methods=["GET"])
+    def mock_calls():
+        endpoint = request.args.get("endpoint")
+        with lock:
+            rows = [c for c in calls if endpoint is None or c["endpoint"] == endpoint]
+        return jsonify(rows)
+
+    @app.route("/__mock/calls", methods=["DELETE"])
+    def mock_clear():
+        with lock:
+            calls.clear()
+            used_tokens.clear()
+        return "", 204
+
+    @app.route("/__mock/stats", methods=["GET"])
+    def mock_stats():
+        stats = {}
+        with lock:
+            for c in calls:
+                s = stats.setdefault(c["endpoint"], {"count": 0, "status": {}})
+                s["count"] += 1
+                s["status"][str(c["status"])] = s["status"].get(str(c["status"]), 0) + 1
+        return jsonify(stats)
+
+    @app.route("/__mock/config", methods=["GET", "POST"])
+    def mock_config():
+        if request.method == "POST":
+            body = request.get_json(force=True)
+            if "latency" in body:
+                config.set_latency(body["latency"])
+            for key in ("rate_429", "rate_5xx", "reply_token_ttl"):
+                if key in body:
+                    setattr(config, key, float(body[key]))
+            if "display_name" in body:
+                config.display_name = body["display_name"]
+        return jsonify(config.as_dict())
+
+    return app
+
+
+def main():
+    ap = argparse.ArgumentParser(description="LINE Messaging API mock server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--latency", action="append", default=[], metavar="ENDPOINT=SPEC",
+                    help="例: default=uniform:20:80, reply=lognormal:3.5:0.4（ms）")
+    ap.add_argument("--rate-429", type=float, default=0.0)
+    ap.add_argument("--rate-5xx", type=float, default=0.0)
+    ap.add_argument("--reply-token-ttl", type=float, default=60.0, help="秒")
+    args = ap.parse_args()
+
+    latency = dict(s.split("=", 1) for s in args.latency)
+    config  = MockConfig(latency, args.rate_429, args.rate_5xx, args.reply_token_ttl)
+    create_app(config).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
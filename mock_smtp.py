@@ -0,0 +1,101 @@
+"""ローカル SMTP 受け口（負荷試験用）
+
+EHLO / AUTH PLAIN / MAIL / RCPT / DATA / NOOP / RSET / QUIT だけを実装し、
+受け取ったメールは件数と直近分だけ保持して捨てる。STARTTLS は未対応
+（app.py は STARTTLS 失敗時に平文で続行する）。
+
+    python mock_smtp.py --port 2525
+    SMTP_HOST=127.0.0.1 SMTP_PORT=2525 python app.py
+"""
+import argparse
+import collections
+import socketserver
+import threading
+import time
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads      = True
+    allow_reuse_address = True
+
+    def __init__(self, address, latency_ms=0.0, keep=100):
+        super().__init__(address, _SmtpSession)
+        self.latency_ms = latency_ms
+        self.lock       = threading.Lock()
+        self.received   = 0
+        self.sessions   = 0
+        self.messages   = collections.deque(maxlen=keep)
+
+    def deliver(self, mail_from, rcpt_to, data):
+        with self.lock:
+            self.received += 1
+            self.messages.append({"ts": time.time(), "from": mail_from, "to": rcpt_to, "size": len(data)})
+
+
+class _SmtpSession(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.sessions += 1
+        self.reply("220 mock-smtp ESMTP ready")
+        mail_from, rcpt_to = None, []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            cmd  = line[:4].upper()
+            if cmd in ("EHLO", "HELO"):
+                self.reply("250-mock-smtp")
+                self.reply("250-AUTH PLAIN")
+                self.reply("250 8BITMIME")
+            elif cmd == "AUTH":
+                self.reply("235 2.7.0 Authentication successful")
+            elif cmd == "MAIL":
+                mail_from, rcpt_to = line[10:].strip(), []
+                self.reply("250 OK")
+            elif cmd == "RCPT":
+                rcpt_to.append(line[8:].strip())
+                self.reply("250 OK")
+            elif cmd == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                chunks = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b".\r\n", b".\n"):
+                        break
+                    chunks.append(chunk)
+                if server.latency_ms:
+                    time.sleep(server.latency_ms / 1000.0)
+                server.deliver(mail_from, rcpt_to, b"".join(chunks))
+                self.reply("250 OK queued")
+            elif cmd in ("NOOP", "RSET"):
+                self.reply("250 OK")
+            elif cmd == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+def start_in_thread(host="127.0.0.1", port=2525, latency_ms=0.0):
+    server = SmtpSink((host, port), latency_ms=latency_ms)
+    threading.Thread(target=server.serve_forever, name="mock-smtp", daemon=True).start()
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser(description="SMTP sink for load tests")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=2525)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    args = ap.parse_args()
+    with SmtpSink((args.host, args.port), latency_ms=args.latency_ms) as server:
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""署名付きポストバックトークン
+
+Flexボタンの postback data に「押されたボタン」「それまでのボタン回答」
+「発行時刻」を詰めて HMAC 署名する。サーバー側のメモリがなくても
+ポストバックだけで状態を組み立て直せる。
+
+    ~alcohol_yes.1a.mk3x9c.Qf0c1Jx9ZbqLw2aE
+     ボタン      回答 発行時刻 署名
+"""
+import base64
+import hashlib
+import hmac
+import time
+
+PREFIX        = "~"
+MAX_DATA_LEN  = 300  # LINE の postback data 上限
+SIG_BYTES     = 12
+
+# ボタン回答のフィールドと選択肢（2bit ずつ: 0=未回答, 1=1番目, 2=2番目）
+BUTTON_FIELDS = [
+    ("性別",               ("女", "男")),
+    ("アルコール",         ("はい", "いいえ")),
+    ("副腎皮質ホルモン剤", ("はい", "いいえ")),
+    ("がん",               ("はい", "いいえ")),
+    ("糖尿病",             ("はい", "いいえ")),
+    ("その他病気",         ("はい", "いいえ")),
+    ("お薬服用",           ("はい", "いいえ")),
+    ("アレルギー",         ("はい", "いいえ")),
+]
+
+
+class InvalidPostbackToken(Exception):
+    pass
+
+
+def is_postback_token(data):
+    return data.startswith(PREFIX)
+
+
+def encode_answers(state):
+    bits = 0
+    for i, (key, choices) in enumerate(BUTTON_FIELDS):
+        v = state.get(key)
+        if v in choices:
+            bits |= (choices.index(v) + 1) << (i * 2)
+    return bits
+
+
+def decode_answers(bits):
+    answers = {}
+    for i, (key, choices) in enumerate(BUTTON_FIELDS):
+        code = (bits >> (i * 2)) & 3
+        if code:
+            answers[key] = choices[code - 1]
+    return answers
+
+
+def _b36(n):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while True:
+        n, r = divmod(n, 36)
+        out = digits[r] + out
+        if not n:
+            return out
+
+
+class PostbackTokens:
+    def __init__(self, secret, max_age=7 * 24 * 3600):
+        if isinstance(secret, str):
+            secret = secret.encode("utf-8")
+        self._mac    = hmac.new(secret, digestmod=hashlib.sha256)
+        self.max_age = max_age
+
+    def _sign(self, user_id, body):
+        mac = self._mac.copy()
+        mac.update(f"{user_id}|{body}".encode("utf-8"))
+        return base64.urlsafe_b64encode(mac.digest()[:SIG_BYTES]).decode("ascii")
+
+    def pack(self, user_id, data, state):
+        body  = f"{data}.{encode_answers(state):x}.{_b36(int(time.time()))}"
+        token = f"{PREFIX}{body}.{self._sign(user_id, body)}"
+        if len(token) > MAX_DATA_LEN:
+            raise ValueError(f"postback data too long: {len(token)}")
+        return token
+
+    def unpack(self, user_id, token):
+        """(ボタンの data, それまでのボタン回答) を返す"""
+        try:
+            body, sig = token[len(PREFIX):].rsplit(".", 1)
+            data, bits, issued = body.split(".")
+            bits, issued = int(bits, 16), int(issued, 36)
+        except ValueError:
+            raise InvalidPostbackToken("malformed token")
+        # 改ざんで非 ASCII が混ざると str 同士の compare_digest は TypeError になるので bytes で比べる
+        if not hmac.compare_digest(sig.encode("utf-8"), self._sign(user_id, body).encode("ascii")):
+            raise InvalidPostbackToken("bad signature")
+        if time.time() - issued > self.max_age:
+            raise InvalidPostbackToken("expired")
+        return data, decode_answers(bits)
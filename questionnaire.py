@@ -0,0 +1,402 @@
+"""問診の質問定義（JSON）の読み込み・検証・コンパイル
+
+質問の並び・文面・入力チェック・ボタンは questionnaires/*.json に置き、
+app.py を書き換えずに問診の内容を変えられるようにする。
+
+    {
+      "name": "初診問診",
+      "steps": [
+        {"key": "電話番号", "prompt": "お電話番号（ハイフンなし）を入力してください。",
+         "input": "digits", "length": [10, 11], "error": "電話番号は10桁または11桁の数字で入力してください。"},
+        {"key": "お薬服用", "prompt": "現在、お薬を服用していますか？",
+         "choices": [{"label": "はい", "data": "med_yes"}, {"label": "いいえ", "data": "med_no"}]},
+        {"key": "服用薬", "when": {"お薬服用": "はい"}, "prompt": "お薬の名前をすべてお伝えください。"}
+      ]
+    }
+
+    input … text（空でなければ可） / digits（数字の文字列のまま） / int（整数で保存） /
+            number（数字を正規化した文字列で保存） / birth_day（year・month のステップと合わせて
+            生年月日・満年齢も保存）。min / max / length で範囲・桁数を絞る
+    choices … ボタンで答えるステップ。data はポストバックの値で、定義全体で重複できない
+    when    … それより前のボタンのステップの回答がこの値のときだけ聞く
+
+読み込んだ定義は検証してから遷移表（Questionnaire）にコンパイルし、内容のハッシュを版にする。
+QuestionnaireRegistry は check_interval 秒に1回だけファイルの更新時刻を確かめ、
+変わっていればコンパイルし直して current を差し替える（検証に失敗したら前の版のまま error に残す）。
+回答中のセッションは開始時の版（ステートの "_qv"）で最後まで進む。
+コンパイル済みの版は版ごとに持っておき、archive_dir にも書き出して再起動後も使えるようにする。
+
+    python questionnaire.py questionnaires/default.json   # 検証して版を表示
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import date
+
+from postback_token import BUTTON_FIELDS
+
+INPUTS       = ("text", "digits", "int", "number", "birth_day")
+STEP_FIELDS  = {"key", "prompt", "input", "error", "min", "max", "length", "choices",
+                "when", "repeat_on_text", "year", "month"}
+DATA_PATTERN = re.compile(r"^[A-Za-z0-9_]{1,64}$")
+MESSAGES     = {
+    "use_buttons": "画面のボタンからお答えください。",
+    "fallback":    "次の入力をお願いします。",
+}
+
+
+class QuestionnaireError(ValueError):
+    pass
+
+
+class Step:
+    __slots__ = ("key", "prompt", "input", "error", "min", "max", "length", "choices",
+                 "when", "repeat_on_text", "year", "month", "reply")
+
+    def __init__(self, spec):
+        self.key            = spec["key"]
+        self.prompt         = spec["prompt"]
+        self.input          = spec.get("input", "text")
+        self.error          = spec.get("error") or spec["prompt"]
+        self.min            = spec.get("min")
+        self.max            = spec.get("max")
+        self.length         = tuple(spec["length"]) if "length" in spec else None
+        self.choices        = {c["data"]: c.get("value", c["label"]) for c in spec.get("choices", ())}
+        self.when           = tuple(spec.get("when", {}).items())
+        self.repeat_on_text = bool(spec.get("repeat_on_text"))
+        self.year           = spec.get("year", "生年月日_年")
+        self.month          = spec.get("month", "生年月日_月")
+        if self.choices:
+            buttons    = [{"label": c["label"], "data": c["data"]} for c in spec["choices"]]
+            self.reply = ("buttons", self.prompt, buttons)
+        else:
+            self.reply = ("text", self.prompt)
+
+    def parse(self, text, state):
+        """入力を保存する値にする（受け付けないときは None）。birth_day は state に直接書く"""
+        if self.input == "text":
+            return text or None
+        # isdigit() だと「²」「①」なども通って int() で落ちるので、10進の数字だけを受け付ける
+        if not text.isdecimal():
+            return None
+        if self.length is not None and len(text) not in self.length:
+            return None
+        if self.input == "digits" and self.min is None and self.max is None:
+            return text  # 桁数だけ見るもの（電話番号など）は int にしない
+        n = int(text)
+        if (self.min is not None and n < self.min) or (self.max is not None and n > self.max):
+            return None
+        if self.input == "digits":
+            return text
+        if self.input == "number":
+            return f"{n}"
+        if self.input == "birth_day":
+            try:
+                birth = date(state.get(self.year), state.get(self.month), n)
+            except (TypeError, ValueError):
+                return None
+            today = date.today()
+            state["生年月日"] = birth.strftime("%Y-%m-%d")
+            state["満年齢"]  = today.year - birth.year - ((today.month, today.day) < (birth.month, birth.day))
+        return n
+
+
+class Questionnaire:
+    """コンパイル済みの質問定義（作ったあとは変更しない）"""
+
+    def __init__(self, spec, version):
+        self.version  = version
+        self.name     = spec.get("name", "")
+        self._steps   = [Step(s) for s in spec["steps"]]
+        self.steps    = [s.key for s in self._steps]
+        self.by_key   = {s.key: s for s in self._steps}
+        self.messages = {**MESSAGES, **spec.get("messages", {})}
+        self.choices  = {}  # ポストバックの data -> (ステップ, 値)
+        for s in self._steps:
+            for data, value in s.choices.items():
+                self.choices[data] = (s.key, value)
+        # ボタン回答をすべて署名付きトークンで運べるか（運べなければ毎回サーバーへ書く）
+        fields = dict(BUTTON_FIELDS)
+        self.tokens_ok = all(
+            s.key in fields and set(s.choices.values()) <= set(fields[s.key])
+            for s in self._steps if s.choices
+        )
+        self.commits = frozenset(data for data in self.choices if self._commits(data))
+
+    def _commits(self, data):
+        """押したあと自由入力（または完了）になるボタンか。前の回答しだいで決まらなければ True"""
+        if not self.tokens_ok:
+            return True
+        key, value = self.choices[data]
+        i = self.steps.index(key)
+        for s in self._steps[i + 1:]:
+            if any(k != key for k, _ in s.when):
+                return True
+            if all(v == value for _, v in s.when):
+                return not s.choices
+        return True
+
+    def next_step(self, state):
+        for s in self._steps:
+            if s.key in state:
+                continue
+            if s.when and any(state.get(k) != v for k, v in s.when):
+                continue
+            return s
+        return None
+
+    def next_question(self, state):
+        s = self.next_step(state)
+        return None if s is None else s.key
+
+    def _reply_after(self, state):
+        s = self.next_step(state)
+        if s is None:
+            state["_finalized"] = True
+            return ("finalize",)
+        return s.reply
+
+    def first_reply(self):
+        return self._steps[0].reply
+
+    def advance_text(self, state, text):
+        s = self.next_step(state)
+        if s is None:
+            return ("text", self.messages["fallback"])
+        if s.choices:
+            return s.reply if s.repeat_on_text else ("text", self.messages["use_buttons"])
+        value = s.parse(text, state)
+        if value is None:
+            return ("text", s.error)
+        state[s.key] = value
+        return self._reply_after(state)
+
+    def advance_postback(self, state, data):
+        if data not in self.choices:
+            return None
+        key, value = self.choices[data]
+        state[key] = value
+        return self._reply_after(state)
+
+    def replies(self):
+        """組み立てておける定型の返信（起動時のウォームアップ用）"""
+        return [s.reply for s in self._steps] + [("text", m) for m in self.messages.values()]
+
+    def describe(self):
+        return {"version": self.version, "name": self.name, "steps": self.steps, "tokens": self.tokens_ok}
+
+
+# ====== 検証 ======
+def _int(where, spec, field):
+    value = spec.get(field)
+    if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+        raise QuestionnaireError(f"{where}: {field} は整数で指定してください")
+    return value
+
+
+def validate(spec):
+    """定義の誤りを QuestionnaireError で返す（最初の1件）"""
+    if not isinstance(spec, dict) or not isinstance(spec.get("steps"), list) or not spec["steps"]:
+        raise QuestionnaireError("steps（質問のリスト）がありません")
+    unknown = set(spec) - {"name", "steps", "messages"}
+    if unknown:
+        raise QuestionnaireError(f"不明な項目: {sorted(unknown)}")
+    messages = spec.get("messages", {})
+    if not isinstance(messages, dict) or set(messages) - set(MESSAGES) \
+            or not all(isinstance(m, str) and m for m in messages.values()):
+        raise QuestionnaireError(f"messages に使える項目は {sorted(MESSAGES)}（空でない文字列）です")
+
+    seen     = {}  # key -> ステップの定義
+    all_data = set()
+    for i, step in enumerate(spec["steps"]):
+        where = f"steps[{i}]"
+        if not isinstance(step, dict):
+            raise QuestionnaireError(f"{where}: オブジェクトで指定してください")
+        key = step.get("key")
+        if not isinstance(key, str) or not key or key.startswith("_"):
+            raise QuestionnaireError(f"{where}: key は「_」で始まらない文字列で指定してください")
+        where = f"steps[{i}]（{key}）"
+        if key in seen:
+            raise QuestionnaireError(f"{where}: key が重複しています")
+        unknown = set(step) - STEP_FIELDS
+        if unknown:
+            raise QuestionnaireError(f"{where}: 不明な項目 {sorted(unknown)}")
+        for field in ("prompt", "error"):
+            if field in step and (not isinstance(step[field], str) or not step[field]):
+                raise QuestionnaireError(f"{where}: {field} は空でない文字列で指定してください")
+        if "prompt" not in step:
+            raise QuestionnaireError(f"{where}: prompt がありません")
+
+        choices = step.get("choices")
+        if choices is not None:
+            if step.keys() & {"input", "min", "max", "length", "year", "month"}:
+                raise QuestionnaireError(f"{where}: choices と input は同時に指定できません")
+            if not isinstance(choices, list) or not choices:
+                raise QuestionnaireError(f"{where}: choices はボタンのリストで指定してください")
+            values = set()
+            for c in choices:
+                if not isinstance(c, dict) or set(c) - {"label", "data", "value"}:
+                    raise QuestionnaireError(f"{where}: ボタンは label・data（・value）で指定してください")
+                label, data = c.get("label"), c.get("data")
+                if not isinstance(label, str) or not 0 < len(label) <= 20:
+                    raise QuestionnaireError(f"{where}: ボタンの label は1〜20文字で指定してください")
+                if not isinstance(data, str) or not DATA_PATTERN.match(data):
+                    raise QuestionnaireError(f"{where}: ボタンの data は英数字と「_」で指定してください")
+                if data in all_data:
+                    raise QuestionnaireError(f"{where}: ボタンの data「{data}」が重複しています")
+                value = c.get("value", label)
+                if not isinstance(value, str) or value in values:
+                    raise QuestionnaireError(f"{where}: ボタンの値「{value}」が重複しています")
+                all_data.add(data)
+                values.add(value)
+        else:
+            if "repeat_on_text" in step:
+                raise QuestionnaireError(f"{where}: repeat_on_text はボタンのステップだけで使えます")
+            kind = step.get("input", "text")
+            if kind not in INPUTS:
+                raise QuestionnaireError(f"{where}: input は {'/'.join(INPUTS)} のいずれかです")
+            lo, hi = _int(where, step, "min"), _int(where, step, "max")
+            if lo is not None and hi is not None and lo > hi:
+                raise QuestionnaireError(f"{where}: min が max より大きくなっています")
+            length = step.get("length")
+            if length is not None and (not isinstance(length, list) or not length
+                                       or not all(isinstance(n, int) and n > 0 for n in length)):
+                raise QuestionnaireError(f"{where}: length は桁数のリストで指定してください")
+            if kind == "text" and (step.keys() & {"min", "max", "length"}):
+                raise QuestionnaireError(f"{where}: text には min・max・length を指定できません")
+            if kind == "birth_day":
+                for field, default in (("year", "生年月日_年"), ("month", "生年月日_月")):
+                    ref = seen.get(step.get(field, default))
+                    if ref is None or ref.get("input") != "int":
+                        raise QuestionnaireError(f"{where}: {field} は前にある int のステップを指定してください")
+            elif step.keys() & {"year", "month"}:
+                raise QuestionnaireError(f"{where}: year・month は birth_day だけで使えます")
+
+        when = step.get("when", {})
+        if not isinstance(when, dict):
+            raise QuestionnaireError(f"{where}: when は {{ステップ: 値}} で指定してください")
+        for ref_key, value in when.items():
+            ref = seen.get(ref_key)
+            if ref is None or "choices" not in ref:
+                raise QuestionnaireError(f"{where}: when の「{ref_key}」は前にあるボタンのステップではありません")
+            if value not in [c.get("value", c["label"]) for c in ref["choices"]]:
+                raise QuestionnaireError(f"{where}: when の値「{value}」は「{ref_key}」の選択肢にありません")
+        seen[key] = step
+
+    if spec["steps"][0].get("when"):
+        raise QuestionnaireError("最初のステップには when を指定できません")
+
+
+def version_of(spec):
+    canonical = json.dumps(spec, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:12]
+
+
+def compile_spec(spec):
+    validate(spec)
+    return Questionnaire(spec, version_of(spec))
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        try:
+            spec = json.load(f)
+        except json.JSONDecodeError as e:
+            raise QuestionnaireError(f"JSON の書式: {e}")
+    return compile_spec(spec), spec
+
+
+# ====== 版の管理と差し替え ======
+class QuestionnaireRegistry:
+    def __init__(self, path, archive_dir="", check_interval=2.0):
+        self.path           = path
+        self.archive_dir    = archive_dir
+        self.check_interval = check_interval  # 0 なら読み直さない
+        self.reloads        = 0
+        self.error          = None  # 最後の読み直しに失敗したときのエラー
+        self.versions       = {}    # 版 -> Questionnaire
+        self._mtime         = None
+        self._next_check    = 0.0
+        self._lock          = threading.Lock()
+        if archive_dir:
+            self._load_archive()
+        # 起動時に読めなければ起動させない
+        self.current = self._install(*load(path))
+        self._mtime  = os.stat(path).st_mtime_ns
+        self._next_check = time.monotonic() + check_interval
+
+    def _load_archive(self):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        for name in sorted(os.listdir(self.archive_dir)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                flow, _ = load(os.path.join(self.archive_dir, name))
+            except (OSError, QuestionnaireError):
+                continue
+            self.versions[flow.version] = flow
+
+    def _install(self, flow, spec):
+        cached = self.versions.get(flow.version)
+        if cached is not None:
+            return cached
+        self.versions[flow.version] = flow
+        if self.archive_dir:
+            target = os.path.join(self.archive_dir, f"{flow.version}.json")
+            tmp    = target + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(spec, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, target)
+        return flow
+
+    def get(self, version=None):
+        """版を指定すればその版（知らない版なら現在の版）を返す"""
+        if self.check_interval and time.monotonic() >= self._next_check:
+            self.refresh()
+        if version is not None:
+            flow = self.versions.get(version)
+            if flow is not None:
+                return flow
+        return self.current
+
+    def refresh(self):
+        """ファイルが変わっていれば読み直す。差し替えたら True"""
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                if mtime == self._mtime:
+                    return False
+                flow = self._install(*load(self.path))
+            except (OSError, QuestionnaireError) as e:
+                self.error = repr(e)
+                return False
+            self._mtime = mtime
+            self.error  = None
+            if flow is self.current:
+                return False
+            self.current  = flow  # 参照の差し替えだけなので読む側はロック不要
+            self.reloads += 1
+            return True
+
+    def describe(self):
+        return {**self.current.describe(), "versions": sorted(self.versions),
+                "reloads": self.reloads, "error": self.error}
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit("usage: python questionnaire.py questionnaires/default.json")
+    try:
+        flow, _ = load(sys.argv[1])
+    except (OSError, QuestionnaireError) as e:
+        sys.exit(f"NG: {e}")
+    print(f"OK: version={flow.version} steps={len(flow.steps)} tokens={flow.tokens_ok}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""/callback 受信内容の記録（リングバッファ）
+
+署名検証を通った Webhook 本文を、受信時刻・署名と一緒に直近 N 件だけメモリに残す。
+個人情報は記録時点で落とす。
+
+    userId 等       … HMAC で置き換え（同じユーザーは同じ値のまま）
+    テキスト本文    … 4桁以下の数字（生年月日・身長・体重）はそのまま、
+                      それ以外の数字は 0、文字は ○ に置き換えて長さだけ残す
+    replyToken など … そのまま（再生時に replay.py が振り直す）
+
+署名付きポストバック（POSTBACK_TOKENS=1）は userId を置き換えると検証に通らないので、
+再生はトークンなしの設定で行う。
+
+書き出した JSON Lines は replay.py でそのまま再生できる。
+"""
+import collections
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+ID_PREFIX = {"userId": "U", "groupId": "C", "roomId": "R", "destination": "U"}
+
+
+def redact_text(text):
+    if text.isdigit():
+        return text if len(text) <= 4 else "0" * len(text)
+    return "".join(c if c.isspace() else "○" for c in text)
+
+
+class TrafficRecorder:
+    def __init__(self, capacity=2000, salt=b""):
+        self.capacity = capacity
+        self._salt    = salt
+        self._ring    = collections.deque(maxlen=capacity)
+        self._lock    = threading.Lock()
+        self.recorded = 0
+
+    def pseudonym(self, key, value):
+        digest = hmac.new(self._salt, value.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+        return ID_PREFIX[key] + digest
+
+    def redact(self, obj, key=None):
+        if isinstance(obj, dict):
+            return {k: self.redact(v, k) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [self.redact(v, key) for v in obj]
+        if isinstance(obj, str):
+            if key in ID_PREFIX:
+                return self.pseudonym(key, obj)
+            if key == "text":
+                return redact_text(obj)
+        return obj
+
+    def record(self, payload, signature, received_at=None):
+        entry = {
+            "received_at": time.time() if received_at is None else received_at,
+            "signature":   signature,  # 元本文の署名（伏せ字後の本文とは一致しない）
+            "body":        self.redact(payload),
+        }
+        with self._lock:
+            self._ring.append(entry)
+            self.recorded += 1
+
+    def entries(self):
+        with self._lock:
+            return list(self._ring)
+
+    def clear(self):
+        with self._lock:
+            self._ring.clear()
+
+    def dump_jsonl(self):
+        return "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in self.entries())
+
+
+def load_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,158 @@
+"""記録した Webhook の再生
+
+recorder.py で書き出した JSON Lines（/debug/recording）を、受信時と同じ間隔で
+/callback へ送り直す。--speed 10 なら10倍速、--speed 0 なら待たずに送る。
+同じユーザーのイベントは同じレーンで記録順に送るので、何度流しても遷移は同じになる。
+replyToken と timestamp は送信時に振り直し、本文はローカルのシークレットで署名し直す。
+
+    # 代替サーバーとアプリを起動して、朝9時台の記録を5倍速で再生
+    python replay.py recording.jsonl --speed 5 --spawn
+
+    # 起動済みのアプリへ
+    python replay.py recording.jsonl --url http://127.0.0.1:5000/callback --secret $LINE_CHANNEL_SECRET
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+import requests
+
+from loadtest import percentile, sign, spawn_stack
+from recorder import load_jsonl
+
+
+def lane_key(body):
+    for ev in body.get("events", []):
+        source = ev.get("source") or {}
+        return source.get("userId") or source.get("groupId") or source.get("roomId") or ""
+    return ""
+
+
+def refresh(body, now_ms):
+    """replyToken と timestamp を送信時点のものにする"""
+    body = dict(body)
+    events = []
+    for ev in body.get("events", []):
+        ev = dict(ev)
+        ev["timestamp"] = now_ms
+        if "replyToken" in ev:
+            ev["replyToken"] = f"rt-{now_ms}-{uuid.uuid4().hex[:16]}"
+        events.append(ev)
+    body["events"] = events
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class Replay:
+    def __init__(self, url, secret, entries, speed=1.0, lanes=16):
+        self.url       = url
+        self.secret    = secret
+        self.entries   = sorted(entries, key=lambda e: e["received_at"])
+        self.speed     = speed
+        self.lanes     = lanes
+        self.lock      = threading.Lock()
+        self.latencies = []
+        self.lags      = []  # 予定時刻からの遅れ
+        self.statuses  = {}
+
+    def offset(self, entry):
+        if not self.speed:
+            return 0.0
+        return (entry["received_at"] - self.entries[0]["received_at"]) / self.speed
+
+    def lane(self, q, started):
+        session = requests.Session()
+        while True:
+            entry = q.get()
+            if entry is None:
+                return
+            due  = started + self.offset(entry)
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            sent = time.perf_counter()
+            data = refresh(entry["body"], int(time.time() * 1000))
+            headers = {"Content-Type": "application/json", "X-Line-Signature": sign(self.secret, data)}
+            try:
+                status = session.post(self.url, data=data, headers=headers, timeout=30).status_code
+            except requests.RequestException:
+                status = 0
+            done = time.perf_counter()
+            with self.lock:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+                self.latencies.append((done - sent) * 1000.0)
+                self.lags.append(max(sent - due, 0.0) * 1000.0)
+
+    def run(self):
+        queues = [queue.Queue() for _ in range(self.lanes)]
+        for entry in self.entries:
+            queues[zlib.crc32(lane_key(entry["body"]).encode()) % self.lanes].put(entry)
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self.lane, args=(q, started), daemon=True) for q in queues]
+        for q, t in zip(queues, threads):
+            q.put(None)
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - started
+
+    def report(self, elapsed):
+        lat  = sorted(self.latencies)
+        lags = sorted(self.lags)
+        span = self.entries[-1]["received_at"] - self.entries[0]["received_at"] if self.entries else 0.0
+        return {
+            "requests":        len(lat),
+            "recorded_span_s": round(span, 3),
+            "speed":           self.speed,
+            "elapsed_s":       round(elapsed, 3),
+            "statuses":        {str(k): v for k, v in sorted(self.statuses.items())},
+            "p50_ms":          round(percentile(lat, 50), 2),
+            "p95_ms":          round(percentile(lat, 95), 2),
+            "p99_ms":          round(percentile(lat, 99), 2),
+            "lag_p99_ms":      round(percentile(lags, 99), 2),
+        }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="replay recorded LINE webhooks")
+    ap.add_argument("recording", help="/debug/recording で取得した JSON Lines")
+    ap.add_argument("--url", default="http://127.0.0.1:5000/callback")
+    ap.add_argument("--secret", default=os.getenv("LINE_CHANNEL_SECRET", "loadtest-secret"))
+    ap.add_argument("--speed", type=float, default=1.0, help="再生速度の倍率（0 は待たずに送る）")
+    ap.add_argument("--lanes", type=int, default=16, help="同時送信数（同じユーザーは同じレーン）")
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    ap.add_argument("--spawn", action="store_true", help="LINE / SMTP の代替サーバーとアプリを起動する")
+    ap.add_argument("--app-cmd", default=f"{sys.executable} app.py")
+    ap.add_argument("--line-port", type=int, default=8081)
+    ap.add_argument("--line-latency", default="lognormal:3.4:0.3", help="mock_line_api の遅延分布（ms）")
+    ap.add_argument("--smtp-port", type=int, default=2525)
+    args = ap.parse_args()
+
+    entries = load_jsonl(args.recording)
+    if not entries:
+        raise SystemExit("recording is empty: " + args.recording)
+
+    app = spawn_stack(args) if args.spawn else None
+    try:
+        replay = Replay(args.url, args.secret, entries, args.speed, args.lanes)
+        rep    = replay.report(replay.run())
+    finally:
+        if app is not None:
+            app.terminate()
+            app.wait(timeout=30)
+
+    if args.json:
+        print(json.dumps(rep, ensure_ascii=False, indent=2))
+    else:
+        print(f"requests={rep['requests']} span={rep['recorded_span_s']}s speed={rep['speed']} elapsed={rep['elapsed_s']}s")
+        print(f"statuses={rep['statuses']}")
+        print(f"p50={rep['p50_ms']}ms p95={rep['p95_ms']}ms p99={rep['p99_ms']}ms lag_p99={rep['lag_p99_ms']}ms")
+
+
+if __name__ == "__main__":
+    main()
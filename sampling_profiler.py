@@ -0,0 +1,87 @@
+"""スタックサンプリングプロファイラ
+
+指定秒数のあいだ sys._current_frames() で全スレッドのスタックを定期的に採取し、
+flamegraph.pl / speedscope にそのまま渡せる collapsed 形式で返す。
+採取中だけスレッドが1本動くので、使っていないときのコストはゼロ。
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+# 待ち状態のスレッド（スケジューラ・書き込みスレッドなど）の末端関数。
+# 関数名だけだとアプリの get() なども消えるので、標準ライブラリのファイルと組で見る
+IDLE_LEAVES = {
+    "wait":                  ("threading.py",),
+    "_wait_for_tstate_lock": ("threading.py",),
+    "select":                ("selectors.py",),
+    "accept":                ("socket.py",),
+    "readinto":              ("socket.py",),
+    "serve_forever":         ("socketserver.py",),
+    "get":                   ("queue.py",),
+    "_worker":               ("concurrent/futures/thread.py",),
+}
+_STDLIB = os.path.dirname(os.__file__)
+
+
+def _idle(code):
+    files = IDLE_LEAVES.get(code.co_name)
+    if files is None or not code.co_filename.startswith(_STDLIB):
+        return False
+    return code.co_filename.replace(os.sep, "/").endswith(files)
+
+_busy = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample(seconds, interval=0.005, include_idle=False):
+    """{(根 … 末端のフレーム名), 採取回数} を返す"""
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusy("profiling already in progress")
+    try:
+        me       = threading.get_ident()
+        counts   = collections.Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if not include_idle and _idle(frame.f_code):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_label(frame))
+                    frame = frame.f_back
+                counts[tuple(reversed(stack))] += 1
+            time.sleep(interval)
+        return counts
+    finally:
+        _busy.release()
+
+
+def collapsed(counts):
+    return "".join(f"{';'.join(stack)} {n}\n" for stack, n in counts.most_common())
+
+
+def top(counts, limit=40):
+    """関数ごとの self / total 採取数"""
+    self_n  = collections.Counter()
+    total_n = collections.Counter()
+    for stack, n in counts.items():
+        self_n[stack[-1]] += n
+        for name in set(stack):
+            total_n[name] += n
+    all_n = sum(counts.values()) or 1
+    lines = [f"{'self%':>7} {'total%':>7}  function  (samples={all_n})"]
+    for name, n in self_n.most_common(limit):
+        lines.append(f"{n * 100.0 / all_n:>6.1f}% {total_n[name] * 100.0 / all_n:>6.1f}%  {name}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,127 @@
+"""バージョン付き回答ステート（楽観的排他制御）
+
+同じユーザーのイベントが同時に届いたとき（「はい」の二度押し、テキストと
+ポストバックの同時到着など）に更新が失われないよう、レコードごとに
+バージョンを持たせて compare-and-set で書き込む。
+ロックはユーザーIDのハッシュで分けたストライプ単位で、CAS の一瞬だけ取る。
+
+共有ストア（Redis の WATCH/MULTI や version 列付きのテーブル）へ置き換える
+場合も read() / compare_and_set() / transact() の3つを実装すればよい。
+"""
+import itertools
+import threading
+
+
+class SessionConflict(Exception):
+    pass
+
+
+class SessionStore:
+    def __init__(self, stripes=64, max_retries=8):
+        self._records   = {}  # user_id -> (version, state)
+        self._locks     = [threading.Lock() for _ in range(stripes)]
+        self._conflicts = [0] * stripes
+        self._versions  = itertools.count(1)  # 全体で単調増加（削除→再作成でも番号を再利用しない）
+        self.max_retries = max_retries
+        self.on_commit   = None  # (user_id, old_state, new_state) -> None、new_state=None は削除
+
+    def _stripe(self, user_id):
+        return hash(user_id) % len(self._locks)
+
+    @property
+    def conflicts(self):
+        return sum(self._conflicts)
+
+    # ====== 読み取り ======
+    def read(self, user_id):
+        """(バージョン, ステートのコピー) を返す。未作成なら (0, {})"""
+        rec = self._records.get(user_id)
+        if rec is None:
+            return 0, {}
+        return rec[0], dict(rec[1])
+
+    def get(self, user_id, default=None):
+        rec = self._records.get(user_id)
+        return default if rec is None else rec[1]
+
+    def version(self, user_id):
+        rec = self._records.get(user_id)
+        return 0 if rec is None else rec[0]
+
+    # ====== 書き込み ======
+    def compare_and_set(self, user_id, expected_version, state):
+        i = self._stripe(user_id)
+        with self._locks[i]:
+            rec = self._records.get(user_id)
+            current = 0 if rec is None else rec[0]
+            if current != expected_version:
+                self._conflicts[i] += 1
+                return False
+            self._commit(user_id, rec, state)
+            return True
+
+    def _commit(self, user_id, rec, state):
+        if state is None:
+            self._records.pop(user_id, None)
+        else:
+            self._records[user_id] = (next(self._versions), state)
+        if self.on_commit is not None:
+            self.on_commit(user_id, None if rec is None else rec[1], state)
+
+    def transact(self, user_id, fn):
+        """fn(state) でステートを書き換えてコミットする。競合したら読み直して再実行。
+
+        fn は副作用を持たないこと（返信などはコミット後に呼び出し側で行う）。
+        (fn の戻り値, コミットしたステート) を返す。
+        """
+        for _ in range(self.max_retries + 1):
+            version, state = self.read(user_id)
+            before = dict(state)
+            result = fn(state)
+            if state == before:
+                return result, state  # 変更なしなら書き込まない
+            if self.compare_and_set(user_id, version, state):
+                return result, state
+        raise SessionConflict(user_id)
+
+    # ====== dict 互換（初期化・復元・管理用。バージョンを無条件に進める） ======
+    def __setitem__(self, user_id, state):
+        i = self._stripe(user_id)
+        with self._locks[i]:
+            self._commit(user_id, self._records.get(user_id), state)
+
+    def pop(self, user_id, default=None):
+        i = self._stripe(user_id)
+        with self._locks[i]:
+            rec = self._records.get(user_id)
+            if rec is None:
+                return default
+            self._commit(user_id, rec, None)
+            return rec[1]
+
+    def setdefault(self, user_id, default):
+        # ジャーナル再生専用：保存中の dict をそのまま返す
+        rec = self._records.get(user_id)
+        if rec is None:
+            self[user_id] = default
+            return default
+        return rec[1]
+
+    def update(self, mapping):
+        for user_id, state in mapping.items():
+            self._records[user_id] = (next(self._versions), state)
+
+    def __getitem__(self, user_id):
+        return self._records[user_id][1]
+
+    def __contains__(self, user_id):
+        return user_id in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def items(self):
+        return [(uid, rec[1]) for uid, rec in list(self._records.items())]
+
+    def clear(self):
+        self._records.clear()
@@ -0,0 +1,112 @@
+"""SMTP 接続の使い回し
+
+問診完了ごとに TLS ハンドシェイクとログインをやり直さないよう、
+ログイン済みの接続を数本だけ手元に置いておく。
+しばらく使っていない接続は NOOP で生きているか確かめ、切れていれば張り直す。
+
+    pool = SmtpPool(host, port, user, password)
+    with pool.connection() as smtp:
+        smtp.send_message(msg)
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+
+class SmtpPool:
+    def __init__(self, host, port, user="", password="", timeout=20, size=2, check_after=10.0, max_idle=240.0):
+        self.host        = host
+        self.port        = port
+        self.user        = user
+        self.password    = password
+        self.timeout     = timeout
+        self.size        = size
+        self.check_after = check_after  # これより長く置いた接続は NOOP で確認
+        self.max_idle    = max_idle     # これより長く置いた接続は捨てる（サーバー側で切られている）
+        self._idle       = []           # [(最後に使った時刻, SMTP)]
+        self._lock       = threading.Lock()
+
+    def _connect(self):
+        import smtplib
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        smtp.ehlo()
+        try:
+            smtp.starttls()
+            smtp.ehlo()
+        except Exception:
+            pass
+        if self.user and self.password:
+            smtp.login(self.user, self.password)
+        return smtp
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                used_at, smtp = self._idle.pop()
+            idle = time.monotonic() - used_at
+            if idle > self.max_idle:
+                self._close(smtp)
+                continue
+            if idle > self.check_after:
+                try:
+                    if smtp.noop()[0] != 250:
+                        raise OSError("noop")
+                except Exception:
+                    self._close(smtp)
+                    continue
+            return smtp
+        return self._connect()
+
+    def _checkin(self, smtp):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((time.monotonic(), smtp))
+                return
+        self._close(smtp)
+
+    @contextmanager
+    def connection(self):
+        smtp = self._checkout()
+        try:
+            yield smtp
+        except Exception:
+            self._close(smtp)  # 送信途中で失敗した接続は使い回さない
+            raise
+        self._checkin(smtp)
+
+    def warm(self, n=1):
+        """起動時に n 本つないでおく"""
+        for _ in range(max(0, n - self.idle())):
+            self._checkin(self._connect())
+
+    def idle(self):
+        with self._lock:
+            return len(self._idle)
+
+    def close(self):
+        with self._lock:
+            conns, self._idle = self._idle, []
+        for _, smtp in conns:
+            self._close(smtp)
+
+    def discard(self):
+        """fork 後の子プロセスで、親の接続に QUIT を送らずに手放す"""
+        with self._lock:
+            conns, self._idle = self._idle, []
+        for _, smtp in conns:
+            try:
+                smtp.close()
+            except Exception:
+                pass
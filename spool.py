@@ -0,0 +1,162 @@
+"""送信待ちの永続キュー（事務局メール・フォローアップの push）
+
+1件を1ファイル（JSON）として書いてから送る。書き込みは一時ファイル + fsync + rename なので、
+put() が返った時点で再起動しても消えない。送信スレッドは古い順に送り、成功したら消す。
+失敗したら指数バックオフで再送し、max_attempts を超えたものは dead/ へ移す。
+
+送信スレッドはディレクトリのロックを取った1プロセスだけが動かす（put はどのプロセスからでもよい）。
+
+    spool = Spool("/var/data/spool")
+    spool.register("mail", deliver_mail)   # deliver_mail(item_id, payload)
+    spool.start()
+    spool.put("mail", {"subject": ..., "body": ...})
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+
+class Spool:
+    def __init__(self, directory, fsync=True, retry_base=5.0, retry_max=600.0, max_attempts=20, on_error=None):
+        self.directory    = directory
+        self.fsync        = fsync
+        self.retry_base   = retry_base
+        self.retry_max    = retry_max
+        self.max_attempts = max_attempts
+        self.on_error     = on_error  # on_error(kind, item_id, attempts, exc)
+        self.delivered    = 0
+        self.failed       = 0
+        self._handlers    = {}
+        self._retry       = {}  # ファイル名 -> (失敗回数, 次に送る時刻)
+        self._wake        = threading.Event()
+        self._stop        = threading.Event()
+        self._thread      = None
+        self._lock_fd     = None
+        os.makedirs(os.path.join(directory, "dead"), exist_ok=True)
+
+    def register(self, kind, func):
+        self._handlers[kind] = func
+
+    # ====== 追加 ======
+    def put(self, kind, payload):
+        item_id = str(uuid.uuid4())
+        name    = f"{time.time_ns():020d}-{kind}-{item_id}.json"
+        tmp     = os.path.join(self.directory, "." + name + ".tmp")
+        data    = json.dumps({"id": item_id, "kind": kind, "created": time.time(), "payload": payload},
+                             ensure_ascii=False).encode("utf-8")
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.directory, name))
+        if self.fsync:
+            fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self._wake.set()
+        return item_id
+
+    def _names(self):
+        return sorted(n for n in os.listdir(self.directory) if n.endswith(".json") and not n.startswith("."))
+
+    def backlog(self):
+        return len(self._names())
+
+    def dead_letters(self):
+        return sum(1 for n in os.listdir(os.path.join(self.directory, "dead")) if n.endswith(".json"))
+
+    def is_sender(self):
+        return self._lock_fd is not None
+
+    # ====== 送信 ======
+    def _deliver(self, name):
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, encoding="utf-8") as f:
+                item = json.load(f)
+        except FileNotFoundError:
+            return True
+        handler = self._handlers.get(item["kind"])
+        try:
+            if handler is None:
+                raise LookupError(f"no handler for {item['kind']}")
+            handler(item["id"], item["payload"])
+        except Exception as e:
+            attempts = self._retry.get(name, (0, 0.0))[0] + 1
+            self.failed += 1
+            if self.on_error is not None:
+                self.on_error(item["kind"], item["id"], attempts, e)
+            if attempts >= self.max_attempts:
+                os.replace(path, os.path.join(self.directory, "dead", name))
+                self._retry.pop(name, None)
+                return True
+            delay = min(self.retry_base * (2 ** (attempts - 1)), self.retry_max)
+            self._retry[name] = (attempts, time.monotonic() + delay)
+            return False
+        os.remove(path)
+        self._retry.pop(name, None)
+        self.delivered += 1
+        return True
+
+    def run_once(self, ignore_backoff=False, deadline=None):
+        """送れるものを古い順に送る。次に試す時刻（なければ None）を返す"""
+        next_due = None
+        for name in self._names():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            if self._stop.is_set() and not ignore_backoff:
+                break
+            _, due = self._retry.get(name, (0, 0.0))
+            if not ignore_backoff and due > time.monotonic():
+                next_due = due if next_due is None else min(next_due, due)
+                continue
+            if not self._deliver(name):
+                due = self._retry[name][1]
+                next_due = due if next_due is None else min(next_due, due)
+        return next_due
+
+    def _acquire(self):
+        import fcntl
+        fd = os.open(os.path.join(self.directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        while not self._stop.is_set():
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._lock_fd = fd
+                return True
+            except OSError:
+                self._stop.wait(30)
+        os.close(fd)
+        return False
+
+    def _sender(self):
+        if not self._acquire():
+            return
+        while not self._stop.is_set():
+            next_due = self.run_once()
+            timeout  = 1.0 if next_due is None else max(0.05, min(next_due - time.monotonic(), 1.0))
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sender, name="spool", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def drain(self, deadline):
+        """終了時: 期限まで送り切りを試みる（送信担当のプロセスだけ）。残った件数を返す"""
+        if self.is_sender():
+            self.run_once(ignore_backoff=True, deadline=deadline)
+        return self.backlog()